@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+BuildCache.py
+
+Content-hash based record of the inputs every generated file was built from,
+letting generateStuff.py skip outputs whose inputs haven't changed.
+'''
+
+import glob
+import hashlib
+import io
+import json
+import os
+
+CACHE_FILE_NAME = '.cacophony_build_cache.json'
+# Directory, next to the cache file, of the intermediate files derived from inputs (see BuildCache.derived_file)
+DERIVED_DIR_NAME = '.cache'
+# Bump whenever the format of the cache file changes; caches of other versions are ignored
+CACHE_VERSION = 1
+
+class BuildCache():
+    """
+    Stored next to the generated files, keeps per output file:
+    - the SHA-256 of every input file (templates, design(s), configuration and its entity files, Cacophony sources),
+    - the generation parameters (anything JSON-serializable, e.g. the --dpt_prefix etc. settings),
+    - the SHA-256 of the output itself, so that hand-edited or deleted outputs get regenerated.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, CACHE_FILE_NAME)
+        self.derived_dir = os.path.join(output_dir, DERIVED_DIR_NAME)
+        self._digests = {}  # digests of files computed during this run
+        self._entries = {}
+        try:
+            with open(self.path, mode='r', encoding='utf-8') as cache_file:
+                content = json.load(cache_file)
+            if content.get('version') == CACHE_VERSION:
+                self._entries = content['outputs']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # no usable cache: everything will be generated
+
+    def file_digest(self, path):
+        """SHA-256 of the file content, None if the file doesn't exist"""
+        path = os.path.abspath(path)
+        if path not in self._digests:
+            try:
+                digest = hashlib.sha256()
+                with open(path, mode='rb') as input_file:
+                    for block in iter(lambda: input_file.read(1 << 20), b''):
+                        digest.update(block)
+                self._digests[path] = digest.hexdigest()
+            except OSError:
+                self._digests[path] = None
+        return self._digests[path]
+
+    def is_up_to_date(self, output_path, parameters):
+        """True if output_path exists unchanged and was built from the current content of all of its inputs with the same parameters"""
+        entry = self._entries.get(os.path.abspath(output_path))
+        if entry is None or entry['parameters'] != parameters:
+            return False
+        if self.file_digest(output_path) != entry['output']:
+            return False
+        return all(self.file_digest(path) == digest for path, digest in entry['inputs'].items())
+
+    def record(self, output_path, input_paths, parameters):
+        """Remember that output_path has just been built from input_paths with parameters"""
+        output_path = os.path.abspath(output_path)
+        # the output has just been rewritten
+        self._digests.pop(output_path, None)
+        self._entries[output_path] = {
+            'parameters': parameters,
+            'inputs': {os.path.abspath(path): self.file_digest(path) for path in input_paths},
+            'output': self.file_digest(output_path)
+        }
+
+    def save(self):
+        """Write the cache file (atomically, so an interrupted run can't leave a corrupted cache behind)"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, mode='w', encoding='utf-8') as cache_file:
+            json.dump({'version': CACHE_VERSION, 'outputs': self._entries}, cache_file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def derived_file(self, file_name, input_paths, produce):
+        """
+        Path of an intermediate file derived from input_paths, e.g. the design merged with the meta design.
+        produce(output_file) writes its content into a text file object; it runs in memory and only when
+        no derived file of the current content of the inputs exists yet, the result being kept under
+        the derived files directory with the digest of the inputs in its name. Older versions are removed.
+        """
+        key = hashlib.sha256()
+        for path in input_paths:
+            digest = self.file_digest(path)
+            if digest is None:
+                raise FileNotFoundError(f"Input of {file_name} not found: {path}")
+            key.update(digest.encode())
+        stem, extension = os.path.splitext(file_name)
+        path = os.path.join(self.derived_dir, f'{stem}-{key.hexdigest()[:16]}{extension}')
+        if not os.path.isfile(path):
+            content = io.StringIO()
+            produce(content)
+            os.makedirs(self.derived_dir, exist_ok=True)
+            temp_path = path + '.tmp'
+            with open(temp_path, mode='w', encoding='utf-8') as derived:
+                derived.write(content.getvalue())
+            os.replace(temp_path, path)
+        for stale_path in glob.glob(os.path.join(glob.escape(self.derived_dir), f'{glob.escape(stem)}-*{extension}')):
+            if stale_path != path:
+                os.remove(stale_path)
+        return path
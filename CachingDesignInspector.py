@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+CachingDesignInspector.py
+
+Memoizing facade of quasar's DesignInspector, used for template rendering.
+'''
+
+# DesignInspector queries which only depend on their arguments (the design doesn't change during generation)
+MEMOIZED_METHODS = (
+    'get_names_of_all_classes',
+    'objectify_class',
+    'objectify_root',
+    'objectify_has_objects',
+    'objectify_cache_variables',
+    'objectify_source_variables',
+    'is_class_always_singleton',
+    'get_class_default_instance_name'
+    )
+
+class CachingDesignInspector():
+    """
+    Wraps a DesignInspector and memoizes the results of its query methods per (method, arguments),
+    so the XPath queries and objectifications repeated inside template loops run once per generation.
+    Anything not memoized is forwarded to the wrapped DesignInspector.
+    Memoized results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, design_inspector):
+        self.design_inspector = design_inspector
+        self._results = {}
+        self._hits = {}
+        self._misses = {}
+        self._configured_classes = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self.design_inspector, name)
+        if name not in MEMOIZED_METHODS:
+            return attribute
+
+        def memoized(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            if key in self._results:
+                self._hits[name] = self._hits.get(name, 0) + 1
+            else:
+                self._misses[name] = self._misses.get(name, 0) + 1
+                self._results[key] = attribute(*args, **kwargs)
+            return self._results[key]
+        return memoized
+
+    def get_configured_classes(self, class_name=None):
+        """
+        Classes instantiated by configuration (hasobjects with instantiateUsing='configuration') directly below
+        the given class, below Root for None: the elements parseConfig configures at that level.
+        """
+        if class_name not in self._configured_classes:
+            if class_name is None:
+                has_objects = getattr(self.objectify_root(), 'hasobjects', ())
+            else:
+                has_objects = self.objectify_has_objects(class_name)
+            self._configured_classes[class_name] = frozenset(
+                ho.get('class') for ho in has_objects if ho.get('instantiateUsing') == 'configuration')
+        return self._configured_classes[class_name]
+
+    def get_statistics(self):
+        """
+        Returns hit/miss counts per memoized method.
+        Format: {'objectify_class': {'hits': 12, 'misses': 4}, ...}
+        """
+        return {name: {'hits': self._hits.get(name, 0), 'misses': self._misses.get(name, 0)}
+                for name in MEMOIZED_METHODS
+                if name in self._hits or name in self._misses}
+
+    def format_statistics(self):
+        """Returns the hit/miss counts as human-readable lines"""
+        lines = []
+        for name, counts in self.get_statistics().items():
+            total = counts['hits'] + counts['misses']
+            lines.append('  {0:32} : {1:6} hits, {2:6} misses ({3:.0%} hit rate)'.format(
+                name, counts['hits'], counts['misses'], counts['hits'] / total))
+        return '\n'.join(lines)
@@ -7,8 +7,15 @@ ConfigInspector.py
 '''
 
 from lxml import etree
+from array import array
+from operator import itemgetter
+import hashlib
 import logging
 import os
+import pickle
+import sys
+
+from PhaseProfiler import PhaseProfiler
 
 # Configure logging with default WARNING level
 # To enable debug messages, set level=logging.DEBUG before importing this module
@@ -19,24 +26,264 @@ DEBUG_XPATH = False
 
 # Quasar Configuration namespace
 QUASAR_CONFIG_NAMESPACES = {'c': 'http://cern.ch/quasar/Configuration'}
+QUASAR_CONFIG_TAG_PREFIX = '{' + QUASAR_CONFIG_NAMESPACES['c'] + '}'
+
+# Parser options making libxml2 expand external entities while parsing, like 'xmllint --noent' does
+ENTITY_EXPANDING_PARSER_OPTIONS = {
+    'load_dtd': True,
+    'resolve_entities': True,
+    'no_network': True,
+    'huge_tree': True
+}
+
+# Content digests of instances, see ConfigInspector.diff
+DIGEST_SIZE = 16
+NO_DIGEST = bytes(DIGEST_SIZE)
+# Parent of the occurrences which are no named instances, in the index
+NOT_AN_INSTANCE = -2
+# Number of instance names kept with every CV profile, for display
+FIRST_INSTANCE_NAMES = 3
+# Bump whenever the index changes; index caches of other versions are ignored
+INDEX_CACHE_VERSION = 1
+
+class CvProfile():
+    """
+    A CV profile of a class: a distinct set of calculated variables (names with their types) found on its instances.
+    Besides attribute access, fields can be read like dict items (profile['cv_names']).
+    The instances having the profile are only counted, with the names of the first ones kept for display;
+    instance_names materializes the full list from the index of the ConfigInspector, on request.
+    """
+    __slots__ = ('signature_full', 'cv_names', 'instance_count', 'first_instance_names',
+                 '_inspector', '_class_id', '_signature')
+
+    def __init__(self, signature_full, instance_count, first_instance_names, inspector, class_id, signature):
+        self.signature_full = signature_full
+        self.cv_names = [name for name, _ in signature_full]
+        self.instance_count = instance_count
+        self.first_instance_names = first_instance_names
+        self._inspector = inspector
+        self._class_id = class_id
+        self._signature = signature
+
+    def __getitem__(self, key):
+        if key.startswith('_'):
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __repr__(self):
+        return f'CvProfile({self.signature_full!r}, instance_count={self.instance_count})'
+
+    @property
+    def cv_info(self):
+        """{'cvName': {'isBoolean': False}, ...}"""
+        return {name: {'isBoolean': is_boolean} for name, is_boolean in self.signature_full}
+
+    @property
+    def instance_names(self):
+        """Names of all the instances having the profile, in document order ('unknown' for unnamed ones)"""
+        return self._inspector._instance_names_of(self._class_id, self._signature)
+
+class EntityFileRecorder(etree.Resolver):
+    """Records the files libxml2 loads while expanding external entities; their resolution is left to libxml2"""
+
+    def __init__(self, config_path):
+        super().__init__()
+        self.config_path = os.path.abspath(config_path)
+        self.files = []
+
+    def resolve(self, system_url, public_id, context):
+        path = url_to_path(system_url)
+        if path != self.config_path and path not in self.files:
+            self.files.append(path)
+        return None
+
+def file_digest(path):
+    """SHA-256 of the file content, None if the file can't be read"""
+    try:
+        digest = hashlib.sha256()
+        with open(path, mode='rb') as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+def url_to_path(url):
+    """Local file path of a system URL as given by libxml2 (a plain path or a file: URL)"""
+    if url.startswith('file:'):
+        from urllib.parse import urlparse, unquote
+        url = unquote(urlparse(url).path)
+    return os.path.abspath(url)
 
 class ConfigInspector():
     """This class inspects configuration XML files to extract calculated variable information"""
 
-    def __init__(self, configPath):
-        """Initialize ConfigInspector with a configuration XML file path"""
-        # Preprocess the config file to resolve entities manually
-        # This is needed because lxml has issues with entity expansion when
-        # entity files don't have proper namespace declarations
-        processed_config = self._preprocess_config_with_entities(configPath)
-
-        # Parse the preprocessed configuration
-        parser = etree.XMLParser()
-        self.tree = etree.parse(processed_config, parser)
-        self.calc_vars_by_class = self._extract_calculated_variables()
+    def __init__(self, configPath, streaming=False, use_xmllint=False, profiler=None):
+        """
+        Initialize ConfigInspector with a configuration XML file path
+
+        streaming: when True, the configuration is indexed in a single iterparse pass which
+                   discards every element once it has been processed, so no tree is kept
+                   (self.tree is None and xpath() is unavailable). Meant for very large
+                   configuration files; the results of all other queries are identical.
+        use_xmllint: when True, external entities are expanded by running 'xmllint --noent'
+                   (exactly like the CTL runtime does) and its output is parsed afterwards.
+                   By default entities are expanded by lxml itself, in the same pass as parsing.
+        profiler: optional PhaseProfiler recording the phases of the construction
+
+        After construction, self.entity_files lists the (absolute paths of) files pulled in by the configuration
+        through external entities.
+        """
+        self.loaded_from_cache = False
+        if profiler is None:
+            profiler = PhaseProfiler(enabled=False)
+        entity_recorder = EntityFileRecorder(configPath)
+        if use_xmllint:
+            with profiler.phase('xmllint expansion'):
+                source, xmllint_entity_files = self._preprocess_config_with_entities(configPath)
+            parser_options = {'huge_tree': True}
+        else:
+            source = configPath
+            parser_options = ENTITY_EXPANDING_PARSER_OPTIONS
+
+        if streaming:
+            self.tree = None
+            events = self._iterparse_releasing(source, parser_options, entity_recorder)
+        else:
+            with profiler.phase('parsing'):
+                parser = etree.XMLParser(**parser_options)
+                parser.resolvers.add(entity_recorder)
+                self.tree = etree.parse(source, parser)
+                self._log_parser_warnings(parser.error_log)
+            events = etree.iterwalk(self.tree, events=('start', 'end'))
+
+        # Single walk of the document; all public queries are answered from the resulting index
+        with profiler.phase('parsing and indexing' if streaming else 'indexing') as counts:
+            self._build_index(self._inherit_config_namespace(events))
+            counts['instances'] = len(self._occurrence_parent) - self._occurrence_parent.count(NOT_AN_INSTANCE)
+            counts['cv_profiles'] = sum(len(profiles) for profiles in self._profiles_by_class.values())
+        if use_xmllint:
+            self.entity_files = xmllint_entity_files
+        else:
+            self.entity_files = entity_recorder.files
+
+    @classmethod
+    def cached(cls, configPath, cache_dir, **options):
+        """
+        ConfigInspector of configPath, loaded from its index cache in cache_dir when that cache was saved
+        from the current content of the configuration file, of all the entity files it includes and of this
+        module; otherwise built with the given constructor options and saved to the cache for the next time.
+        A loaded inspector has loaded_from_cache set and answers every query but xpath(), like in streaming mode.
+        """
+        profiler = options.get('profiler') or PhaseProfiler(enabled=False)
+        cache_path = os.path.join(cache_dir, 'config_index-{0}.pickle'.format(
+            hashlib.sha256(os.path.abspath(configPath).encode()).hexdigest()[:16]))
+        with profiler.phase('index cache lookup') as counts:
+            inspector = cls._load_index_cache(cache_path, configPath)
+            counts['hit'] = inspector is not None
+        if inspector is None:
+            inspector = cls(configPath, **options)
+            with profiler.phase('index cache save'):
+                inspector._save_index_cache(cache_path, configPath)
+        return inspector
+
+    @staticmethod
+    def _index_cache_inputs(configPath, entity_files):
+        return [os.path.abspath(configPath)] + list(entity_files) + [os.path.abspath(__file__)]
+
+    @staticmethod
+    def _load_index_cache(cache_path, configPath):
+        """The inspector saved in cache_path, None when there's none or it's outdated"""
+        try:
+            with open(cache_path, mode='rb') as cache_file:
+                # the header comes first, so that outdated caches aren't unpickled further
+                header = pickle.load(cache_file)
+                if header.get('version') != INDEX_CACHE_VERSION or header.get('config') != os.path.abspath(configPath):
+                    return None
+                if any(file_digest(path) != digest for path, digest in header['inputs'].items()):
+                    return None
+                inspector = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError, TypeError, ValueError):
+            return None
+        inspector.loaded_from_cache = True
+        return inspector
+
+    def _save_index_cache(self, cache_path, configPath):
+        """Save the index with the digests of its inputs (atomically, so an interrupted run can't leave a corrupted cache behind)"""
+        header = {
+            'version': INDEX_CACHE_VERSION,
+            'config': os.path.abspath(configPath),
+            'inputs': {path: file_digest(path) for path in self._index_cache_inputs(configPath, self.entity_files)}
+        }
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, mode='wb') as cache_file:
+            pickle.dump(header, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+
+    def __getstate__(self):
+        """
+        The parsed tree can't be pickled: a copy (e.g. the one sent to a worker process) only carries
+        the index, which answers every query but xpath(), like in streaming mode.
+        """
+        state = self.__dict__.copy()
+        state['tree'] = None
+        return state
+
+    @staticmethod
+    def _log_parser_warnings(error_log):
+        """Report recoverable parser problems (e.g. an entity file which can't be loaded) the way xmllint does"""
+        for entry in error_log:
+            logging.warning(f'{entry.filename}:{entry.line}: {entry.message}')
+
+    @classmethod
+    def _iterparse_releasing(cls, source, parser_options, resolver):
+        """
+        Generate 'start'/'end' events like etree.iterwalk() does, but straight from the parser,
+        clearing every element after its 'end' event and detaching its processed siblings.
+        The partial tree held in memory is then bounded by the depth of the document.
+        """
+        context = etree.iterparse(source, events=('start', 'end'), **parser_options)
+        context.resolvers.add(resolver)
+        for event, elem in context:
+            yield event, elem
+            if event == 'end':
+                elem.clear(keep_tail=False)
+                parent = elem.getparent()
+                if parent is not None:
+                    while elem.getprevious() is not None:
+                        del parent[0]
+        cls._log_parser_warnings(context.error_log)
+
+    @staticmethod
+    def _inherit_config_namespace(events):
+        """
+        libxml2 parses the content of external entities without the namespace declarations
+        in scope where the entity is referenced, so entity files which don't declare the
+        quasar configuration namespace give un-namespaced elements. xmllint --noent output
+        re-parsed has these elements in the default namespace of their context; this
+        gives the same result by moving such elements into the namespace of their parent
+        as they are walked.
+        """
+        namespaced = []
+        for event, elem in events:
+            if event == 'start':
+                tag = elem.tag
+                if tag[0] != '{' and namespaced and namespaced[-1]:
+                    tag = elem.tag = QUASAR_CONFIG_TAG_PREFIX + tag
+                namespaced.append(tag.startswith(QUASAR_CONFIG_TAG_PREFIX))
+            else:
+                namespaced.pop()
+            yield event, elem
 
     def xpath(self, expr, *args):
         """Just a wrapper on top of etree.xpath that does quasar config namespaces mapping"""
+        if self.tree is None:
+            raise Exception("ERROR: xpath() is not available on a ConfigInspector built in streaming mode.")
         xpath_expr = expr.format(*args)
         result = self.tree.xpath(xpath_expr, namespaces=QUASAR_CONFIG_NAMESPACES)
         if DEBUG_XPATH:
@@ -51,10 +298,7 @@ class ConfigInspector():
         Returns: True if class exists
         Raises: Exception if class not found
         """
-        xpath = f'//c:{class_name}'
-        instances = self.xpath(xpath)
-
-        if not instances:
+        if class_name not in self._class_ids:
             raise Exception(
                 f"ERROR: Class '{class_name}' NOT FOUND in configuration file. "
                 f"No instances of this class exist in the configuration."
@@ -65,21 +309,18 @@ class ConfigInspector():
         """
         Validate that a specific instance exists in the configuration file.
 
-        Returns: The instance element if found
+        Returns: True if instance exists
         Raises: Exception if class or instance not found
         """
         # First validate class exists
         self._validate_class_exists(class_name)
 
         # Then check for specific instance
-        xpath = f'//c:{class_name}[@name="{instance_name}"]'
-        instances = self.xpath(xpath)
-
-        if not instances:
+        if instance_name not in self._instance_profile_table(class_name):
             raise Exception(
                 f"ERROR: Instance '{instance_name}' of class '{class_name}' NOT FOUND in configuration file."
             )
-        return instances[0]
+        return True
 
     def _validate_cv_name(self, name, parent_class, instance_name=None):
         """
@@ -115,17 +356,17 @@ class ConfigInspector():
         """
         Preprocess configuration file to expand external entities using xmllint.
         This uses the same entity expansion method as the CTL runtime (xmllint --noent)
-        to ensure consistent handling of entities between build time and runtime.
+        and is kept to verify the in-process expansion against it (use_xmllint=True).
 
-        Returns a file-like object with the preprocessed content.
+        Returns a file-like object with the preprocessed content and the list of files loaded through entities.
 
         Raises:
             FileNotFoundError: if xmllint is not available
             Exception: if xmllint fails to process the file
         """
         import subprocess
-        import tempfile
         import shutil
+        from io import BytesIO
 
         # Check if xmllint is available
         if shutil.which('xmllint') is None:
@@ -135,142 +376,348 @@ class ConfigInspector():
                 "xmllint is required for entity expansion in configuration files."
             )
 
-        # Create temporary file for expanded content
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.xml', prefix='config_expanded_')
+        # Use xmllint --noent to expand entities (same as CTL runtime)
+        # The output is kept as bytes: lxml parses it as such, without any decode/encode round-trip
+        # --load-trace makes xmllint list the files it loads, i.e. the entity files, on stderr
+        result = subprocess.run(
+            ['xmllint', '--noent', '--load-trace', configPath],
+            capture_output=True,
+            check=False  # We'll check return code manually
+        )
 
-        try:
-            # Close the file descriptor as we'll write via subprocess
-            os.close(temp_fd)
-
-            # Use xmllint --noent to expand entities (same as CTL runtime)
-            # This ensures consistent entity resolution between build time and runtime
-            result = subprocess.run(
-                ['xmllint', '--noent', configPath],
-                capture_output=True,
-                text=True,
-                check=False  # We'll check return code manually
+        if result.returncode != 0:
+            raise Exception(
+                f"ERROR: xmllint failed to process configuration file '{configPath}'. "
+                f"Return code: {result.returncode}\n"
+                f"Error output: {result.stderr.decode('utf-8', errors='replace')}"
             )
 
-            if result.returncode != 0:
-                raise Exception(
-                    f"ERROR: xmllint failed to process configuration file '{configPath}'. "
-                    f"Return code: {result.returncode}\n"
-                    f"Error output: {result.stderr}"
-                )
+        entity_files = []
+        for line in result.stderr.decode('utf-8', errors='replace').splitlines():
+            if line.startswith('Loaded URL="'):
+                # URLs are given as resolved by xmllint, relative ones are relative to the working directory
+                path = url_to_path(line.split('"')[1])
+                if path != os.path.abspath(configPath) and path not in entity_files:
+                    entity_files.append(path)
 
-            # Write expanded content to temp file
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                f.write(result.stdout)
+        if DEBUG:
+            logging.debug(f'Entity expansion completed using xmllint for: {configPath}')
 
-            if DEBUG:
-                logging.debug(f'Entity expansion completed using xmllint for: {configPath}')
-                logging.debug(f'Expanded content written to temporary file: {temp_path}')
-
-            # Return file-like object (BytesIO) for lxml to parse
-            from io import BytesIO
-            return BytesIO(result.stdout.encode('utf-8'))
-
-        except Exception:
-            # Clean up temp file on error
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise
-
-        finally:
-            # Clean up temp file after parsing (best effort)
-            # Note: The BytesIO object contains the content, so we can delete the file
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-            except Exception:
-                pass  # Ignore cleanup errors
-
-    def _extract_calculated_variables(self):
-        """
-        Extract calculated variables from the configuration file organized by parent class.
-
-        Returns: {
-            'ClassName': {
-                'varName': {'isBoolean': False, 'occurrences': 3},
+        # Return file-like object (BytesIO) for lxml to parse
+        return BytesIO(result.stdout), entity_files
+
+    def _build_index(self, events):
+        """
+        Walk the configuration once and build the index every public query is answered from.
+
+        events: (event, element) pairs for 'start' and 'end' events, in document order,
+                as produced by etree.iterwalk() or _iterparse_releasing(). Only attributes
+                are read, at 'start', so elements may be discarded after their 'end' event.
+
+        Every element of the configuration namespace but CalculatedVariable is an occurrence of its class.
+        Per occurrence the index only keeps integers in arrays, indexes into shared tables of interned
+        strings, plus the content digest of named instances; names, full names and the instance lists of
+        CV profiles are materialized on request. Beyond these arrays, memory scales with the number of
+        distinct classes, names and CV profiles, not with the number of instances.
+
+        Sets:
+            self.calc_vars_by_class: {
+                'ClassName': {
+                    'varName': {'isBoolean': False, 'occurrences': 3},
+                    ...
+                },
                 ...
-            },
-            ...
-        }
+            }
+            self._profiles_by_class: {'ClassName': {'1': CvProfile, ...}, ...}
+                (see get_cv_profiles_for_class)
+            self._top_level_instances: [
+                {'class': 'ClassName', 'name': 'instanceName', 'weight': 42},
+                ...
+            ] (see get_top_level_instances)
+            self._class_names, self._names: tables of the class names and of the names of the occurrences
+            self._class_ids: {'ClassName': index in self._class_names}
+            self._occurrence_class, self._occurrence_name, self._occurrence_parent, self._occurrence_signature:
+                arrays indexed by occurrence, in document order, of its class (index in self._class_names),
+                its name (index in self._names, -1 without name), the occurrence of the named instance enclosing
+                it (-1 for none, NOT_AN_INSTANCE when the occurrence is no named instance) and its CV signature
+                (index in the signatures of its class, -1 without CVs)
+            self._digests: content digests of the named instances, DIGEST_SIZE bytes per occurrence
+            self._signature_profiles: {class index: [profile ID of every signature index of the class]}
         """
         calc_vars_by_class = {}
         # Temporary dict for cross-class type conflict warnings only
         global_cv_types = {}
+        class_names = []
+        class_ids = {}
+        names = []
+        name_ids = {}
+        occurrence_class = array('i')
+        occurrence_name = array('i')
+        occurrence_parent = array('i')
+        occurrence_signature = array('i')
+        digests = bytearray()
+        # Per class index: {signature: signature index}, signatures being sorted (cv_name, is_boolean) tuples
+        signature_ids = []
+        # Stack of (class_name, signature_components, instance, owned, occurrence) for the elements currently open,
+        # instance being the [occurrence, content_hash] of the nearest named instance enclosing the element
+        # (or the element itself when owned) and occurrence -1 for elements which are no occurrences
+        open_elements = []
+        # Children of the configuration element, with the number of elements of their subtrees
+        top_level_instances = []
+
+        for event, elem in events:
+            if event == 'end':
+                _, components, instance, owned, occurrence = open_elements.pop()
+                if instance is not None:
+                    if elem.text and elem.text.strip():
+                        instance[1].update(elem.text.strip().encode())
+                    if owned:
+                        digests[occurrence * DIGEST_SIZE:(occurrence + 1) * DIGEST_SIZE] = instance[1].digest()
+                if components:
+                    # Sorted by name for consistency, independent of the order of the CalculatedVariable elements
+                    signature = tuple(sorted(components, key=itemgetter(0)))
+                    class_signatures = signature_ids[occurrence_class[occurrence]]
+                    occurrence_signature[occurrence] = class_signatures.setdefault(signature, len(class_signatures))
+                continue
 
-        # Find all CalculatedVariable elements (using namespace)
-        calc_var_elements = self.xpath('//c:CalculatedVariable')
+            if len(open_elements) > 1 and top_level_instances:
+                top_level_instances[-1]['weight'] += 1
 
-        for cv_elem in calc_var_elements:
-            name = cv_elem.get('name')
-            is_boolean_str = cv_elem.get('isBoolean', 'false')
-            is_boolean = is_boolean_str.lower() == 'true'
+            tag = elem.tag
+            in_config_namespace = tag.startswith(QUASAR_CONFIG_TAG_PREFIX)
+            # Remove namespace prefix from tag name
+            class_name = tag.split('}')[-1] if '}' in tag else tag
+            parent_class, parent_components, parent_instance, _, _ = open_elements[-1] if open_elements else ('Unknown', None, None, False, -1)
 
-            # Find parent class tag name (strip namespace if present)
-            parent = cv_elem.getparent()
-            if parent is not None:
-                # Remove namespace prefix from tag name
-                parent_class = parent.tag.split('}')[-1] if '}' in parent.tag else parent.tag
-            else:
-                parent_class = 'Unknown'
-
-            # Validate CV name is non-empty and non-whitespace
-            if name and name.strip():
-                self._validate_cv_name(name, parent_class)
-
-                # Track globally for cross-class type conflict warnings
-                if name not in global_cv_types:
-                    global_cv_types[name] = {
-                        'isBoolean': is_boolean,
-                        'first_class': parent_class
-                    }
+            if in_config_namespace and class_name == 'CalculatedVariable':
+                self._index_calculated_variable(
+                    elem, parent_class, parent_components, calc_vars_by_class, global_cv_types)
+                self._hash_element_content(parent_instance, class_name, elem)
+                open_elements.append((class_name, None, parent_instance, False, -1))
+                continue
+
+            name = elem.get('name')
+            instance = parent_instance
+            owned = False
+            occurrence = -1
+            if in_config_namespace:
+                components = []
+                occurrence = len(occurrence_class)
+                class_id = class_ids.get(class_name)
+                if class_id is None:
+                    class_id = class_ids[class_name] = len(class_names)
+                    class_names.append(sys.intern(class_name))
+                    signature_ids.append({})
+                occurrence_class.append(class_id)
+                if name is None:
+                    occurrence_name.append(-1)
                 else:
-                    # Check for cross-class type conflicts
-                    existing_type = global_cv_types[name]['isBoolean']
-                    if existing_type != is_boolean:
-                        first_class = global_cv_types[name]['first_class']
-                        logging.warning(
-                            f"Cross-class type conflict for calculated variable '{name}': "
-                            f"defined as isBoolean={existing_type} in class '{first_class}', "
-                            f"but as isBoolean={is_boolean} in class '{parent_class}'. "
-                            f"Using isBoolean=True (boolean type takes precedence)."
-                        )
-                        global_cv_types[name]['isBoolean'] = True
-                    elif is_boolean:
-                        global_cv_types[name]['isBoolean'] = True
-
-                # Per-class tracking
-                if parent_class not in calc_vars_by_class:
-                    calc_vars_by_class[parent_class] = {}
-
-                if name not in calc_vars_by_class[parent_class]:
-                    calc_vars_by_class[parent_class][name] = {
-                        'isBoolean': is_boolean,
-                        'occurrences': 0
-                    }
+                    name_id = name_ids.get(name)
+                    if name_id is None:
+                        name_id = name_ids[name] = len(names)
+                        names.append(sys.intern(name))
+                    occurrence_name.append(name_id)
+                occurrence_signature.append(-1)
+                digests.extend(NO_DIGEST)
+                if len(open_elements) == 1:
+                    top_level_instances.append({'class': class_names[class_id],
+                                                'name': None if name is None else names[name_id],
+                                                'weight': 1})
+                if open_elements and name is not None:
+                    occurrence_parent.append(parent_instance[0] if parent_instance else -1)
+                    instance = [occurrence, hashlib.blake2b(digest_size=DIGEST_SIZE)]
+                    owned = True
                 else:
-                    # Check for type conflicts within the same class
-                    existing_type = calc_vars_by_class[parent_class][name]['isBoolean']
-                    if existing_type != is_boolean:
-                        logging.warning(
-                            f"Type conflict for calculated variable '{name}' within class '{parent_class}': "
-                            f"previously isBoolean={existing_type}, now found isBoolean={is_boolean}. "
-                            f"Using isBoolean=True (boolean type takes precedence)."
-                        )
-                        calc_vars_by_class[parent_class][name]['isBoolean'] = True
-                    elif is_boolean:
-                        calc_vars_by_class[parent_class][name]['isBoolean'] = True
-
-                calc_vars_by_class[parent_class][name]['occurrences'] += 1
+                    occurrence_parent.append(NOT_AN_INSTANCE)
+            else:
+                components = None
+            self._hash_element_content(instance, class_name, elem)
+            open_elements.append((class_name, components, instance, owned, occurrence))
+
+        self.calc_vars_by_class = calc_vars_by_class
+        self._top_level_instances = top_level_instances
+        self._class_names = class_names
+        self._class_ids = class_ids
+        self._names = names
+        self._occurrence_class = occurrence_class
+        self._occurrence_name = occurrence_name
+        self._occurrence_parent = occurrence_parent
+        self._occurrence_signature = occurrence_signature
+        self._digests = digests
+        # Built on request by _instance_profile_table
+        self._instance_profiles = {}
+        self._index_profiles(signature_ids)
 
         if DEBUG:
             logging.debug(f'Calculated variables by class: {calc_vars_by_class}')
 
-        # Return by-class information
-        return calc_vars_by_class
+    @staticmethod
+    def _hash_element_content(instance, tag, elem):
+        """Account the tag and attributes of an element in the content hash of the instance it belongs to"""
+        if instance is not None:
+            instance[1].update(repr((tag, sorted(elem.attrib.items()))).encode())
+
+    def _index_calculated_variable(self, cv_elem, parent_class, parent_components, calc_vars_by_class, global_cv_types):
+        """
+        Account a single CalculatedVariable element in the per-class statistics and
+        append its (name, isBoolean) pair to the signature components of its parent instance.
+        """
+        name = cv_elem.get('name')
+        is_boolean_str = cv_elem.get('isBoolean', 'false')
+        is_boolean = is_boolean_str.lower() == 'true'
+
+        # Validate CV name is non-empty and non-whitespace
+        if not (name and name.strip()):
+            return
+        self._validate_cv_name(name, parent_class)
+        # The same few CV names repeat over all the instances
+        name = sys.intern(name)
+
+        if parent_components is not None:
+            parent_components.append((name, is_boolean))
+
+        # Track globally for cross-class type conflict warnings
+        if name not in global_cv_types:
+            global_cv_types[name] = {
+                'isBoolean': is_boolean,
+                'first_class': parent_class
+            }
+        else:
+            # Check for cross-class type conflicts
+            existing_type = global_cv_types[name]['isBoolean']
+            if existing_type != is_boolean:
+                first_class = global_cv_types[name]['first_class']
+                logging.warning(
+                    f"Cross-class type conflict for calculated variable '{name}': "
+                    f"defined as isBoolean={existing_type} in class '{first_class}', "
+                    f"but as isBoolean={is_boolean} in class '{parent_class}'. "
+                    f"Using isBoolean=True (boolean type takes precedence)."
+                )
+                global_cv_types[name]['isBoolean'] = True
+            elif is_boolean:
+                global_cv_types[name]['isBoolean'] = True
+
+        # Per-class tracking
+        if parent_class not in calc_vars_by_class:
+            calc_vars_by_class[parent_class] = {}
+
+        if name not in calc_vars_by_class[parent_class]:
+            calc_vars_by_class[parent_class][name] = {
+                'isBoolean': is_boolean,
+                'occurrences': 0
+            }
+        else:
+            # Check for type conflicts within the same class
+            existing_type = calc_vars_by_class[parent_class][name]['isBoolean']
+            if existing_type != is_boolean:
+                logging.warning(
+                    f"Type conflict for calculated variable '{name}' within class '{parent_class}': "
+                    f"previously isBoolean={existing_type}, now found isBoolean={is_boolean}. "
+                    f"Using isBoolean=True (boolean type takes precedence)."
+                )
+                calc_vars_by_class[parent_class][name]['isBoolean'] = True
+            elif is_boolean:
+                calc_vars_by_class[parent_class][name]['isBoolean'] = True
+
+        calc_vars_by_class[parent_class][name]['occurrences'] += 1
+
+    def _index_profiles(self, signature_ids):
+        """
+        Turn the CV signatures found on the instances of every class into its CV profiles.
+
+        signature_ids: per class index, {signature: signature index}
+        """
+        self._profiles_by_class = {}
+        self._signature_profiles = {}
+        instance_counts = [[0] * len(class_signatures) for class_signatures in signature_ids]
+        first_instance_names = [[[] for _ in class_signatures] for class_signatures in signature_ids]
+        for class_id, name_id, signature in zip(self._occurrence_class, self._occurrence_name, self._occurrence_signature):
+            if signature < 0:
+                continue
+            instance_counts[class_id][signature] += 1
+            samples = first_instance_names[class_id][signature]
+            if len(samples) < FIRST_INSTANCE_NAMES:
+                samples.append(self._names[name_id] if name_id >= 0 else 'unknown')
+
+        for class_id, class_signatures in enumerate(signature_ids):
+            if not class_signatures:
+                continue
+            # Sort signatures alphabetically to ensure profile numbering independent of XML element order
+            profile_ids = [None] * len(class_signatures)
+            profiles = {}
+            for index, signature_full in enumerate(sorted(class_signatures), start=1):
+                signature = class_signatures[signature_full]
+                profile_ids[signature] = str(index)
+                profiles[str(index)] = CvProfile(
+                    signature_full, instance_counts[class_id][signature], first_instance_names[class_id][signature],
+                    self, class_id, signature)
+            self._signature_profiles[class_id] = profile_ids
+            self._profiles_by_class[self._class_names[class_id]] = profiles
+            if DEBUG:
+                logging.debug(f'CV profiles for class {self._class_names[class_id]}: {profiles}')
+
+    def _profile_of(self, occurrence):
+        """Profile ID of an occurrence, None without CVs"""
+        signature = self._occurrence_signature[occurrence]
+        if signature < 0:
+            return None
+        return self._signature_profiles[self._occurrence_class[occurrence]][signature]
+
+    def _instance_names_of(self, class_id, signature):
+        """Names of the occurrences of a class with a given CV signature, in document order"""
+        return [self._names[name_id] if name_id >= 0 else 'unknown'
+                for occurrence_class_id, name_id, occurrence_signature
+                in zip(self._occurrence_class, self._occurrence_name, self._occurrence_signature)
+                if occurrence_class_id == class_id and occurrence_signature == signature]
+
+    def _instance_profile_table(self, class_name):
+        """
+        {'instanceName': profile_id or None} of the named occurrences of a class, built on first request.
+        Lookups by name resolve to the first instance of that name, in document order.
+        """
+        if class_name not in self._instance_profiles:
+            class_id = self._class_ids[class_name]
+            table = {}
+            for occurrence, (occurrence_class_id, name_id) in enumerate(zip(self._occurrence_class, self._occurrence_name)):
+                if occurrence_class_id == class_id and name_id >= 0 and self._names[name_id] not in table:
+                    table[self._names[name_id]] = self._profile_of(occurrence)
+            self._instance_profiles[class_name] = table
+        return self._instance_profiles[class_name]
+
+    def _named_instances(self):
+        """
+        {'parentName/instanceName': (class_name, content_digest, profile_id or None)} of the named instances,
+        in document order, materialized from the index. Lookups by name resolve to the first instance of that name.
+        """
+        full_names = {}
+        instances = {}
+        for occurrence, parent in enumerate(self._occurrence_parent):
+            if parent == NOT_AN_INSTANCE:
+                continue
+            name = self._names[self._occurrence_name[occurrence]]
+            full_name = full_names[parent] + '/' + name if parent >= 0 else name
+            full_names[occurrence] = full_name
+            if full_name not in instances:
+                instances[full_name] = (
+                    self._class_names[self._occurrence_class[occurrence]],
+                    bytes(self._digests[occurrence * DIGEST_SIZE:(occurrence + 1) * DIGEST_SIZE]),
+                    self._profile_of(occurrence))
+        return instances
+
+    def _configured_instances(self, configured_classes):
+        """
+        The part of _named_instances parseConfig configures: the instances of the classes configured_classes(None)
+        gives at the top level, then below each of them, the instances of the classes configured_classes(its class)
+        gives, and so on. Everything else (FreeVariable, CalculatedVariableGenericFormula...) is left out.
+        """
+        instances = {}
+        for full_name, record in self._named_instances().items():
+            parent_name = full_name.rpartition('/')[0]
+            if parent_name and parent_name not in instances:
+                continue
+            if record[0] in configured_classes(instances[parent_name][0] if parent_name else None):
+                instances[full_name] = record
+        return instances
 
     def get_calculated_variables_by_parent_class(self):
         """
@@ -297,17 +744,16 @@ class ConfigInspector():
 
         Returns:
         {
-            '1': {
-                'signature_full': ('cv1', 'cv2', 'cv3'),  # Full sorted tuple of CV names
-                'cv_names': ['cv1', 'cv2', 'cv3'],  # List of CV names
+            '1': CvProfile, with the fields (read as attributes or dict items):
+                'signature_full': (('cv1', False), ('cv2', True)),  # Sorted tuple of (CV name, isBoolean)
+                'cv_names': ['cv1', 'cv2'],  # List of CV names
                 'cv_info': {
                     'cv1': {'isBoolean': False},
-                    'cv2': {'isBoolean': False},
-                    ...
+                    'cv2': {'isBoolean': True}
                 },
-                'instance_names': ['instance1', 'instance2', ...],  # Names of instances with this profile
-                'instance_count': 5
-            },
+                'instance_count': 5,
+                'first_instance_names': ['instance1', 'instance2', 'instance3'],  # at most 3
+                'instance_names': ['instance1', 'instance2', ...],  # all of them, materialized on access
             ...
         }
         Note: The profile number is the dict key (e.g., '1', '2', '3')
@@ -315,90 +761,33 @@ class ConfigInspector():
         Returns empty dict {} if:
         - Class doesn't exist in configuration (normal - not all design classes are instantiated)
         - Class exists but has no calculated variables (normal - CVs are optional)
-        """
-        profiles = {}
-        profile_lookup = {}  # Map signature_full to profile_id for fast lookup
-        next_profile_number = 1
-
-        # Find all instances of this class that have CalculatedVariables
-        # NOTE: Don't validate class exists - templates call this for ALL design classes,
-        # but not all design classes are instantiated in configuration
-        xpath = f'//c:{class_name}[c:CalculatedVariable]'
-        instances = self.xpath(xpath)
 
-        # Return empty dict if class not in config OR class has no CVs (both are normal)
-        if not instances:
+        Profiles are detected once, when the configuration is indexed; the returned dict is
+        shared between calls and must not be modified by the caller.
+        """
+        if class_name not in self._profiles_by_class:
             if DEBUG:
                 logging.debug(f'Class {class_name} has no CV profiles (not in config or no CVs)')
             return {}
+        return self._profiles_by_class[class_name]
 
-        for instance in instances:
-            instance_name = instance.get('name', 'unknown')
-
-            # Get all CV names for this specific instance
-            cv_elements = instance.xpath('./c:CalculatedVariable', namespaces=QUASAR_CONFIG_NAMESPACES)
-
-            # Validate and collect CV names with type information (filter out empty/whitespace-only names)
-            signature_components = []
-            cv_info_temp = {}
-            for cv_elem in cv_elements:
-                name = cv_elem.get('name')
-                if name and name.strip():
-                    self._validate_cv_name(name, class_name, instance_name)
-                    is_boolean = cv_elem.get('isBoolean', 'false').lower() == 'true'
-                    cv_info_temp[name] = {'isBoolean': is_boolean}
-                    # Include type in signature: (name, isBoolean)
-                    signature_components.append((name, is_boolean))
-
-            # Sort by name for consistency
-            signature_components.sort(key=lambda x: x[0])
-
-            if not signature_components:
-                continue
-
-            # Create full signature with type information: (('current', False), ('voltage', False))
-            # This ensures instances with same CV names but different types get separate profiles
-            signature_full = tuple(signature_components)
-
-            # Extract just the names for cv_names list
-            cv_names = sorted([comp[0] for comp in signature_components])
-
-            # Check if we've seen this signature before
-            if signature_full in profile_lookup:
-                profile_id = profile_lookup[signature_full]
-                profiles[profile_id]['instance_count'] += 1
-                profiles[profile_id]['instance_names'].append(instance_name)
-            else:
-                # Assign next profile number as string ID
-                profile_id = str(next_profile_number)
-                next_profile_number += 1
-
-                profiles[profile_id] = {
-                    'signature_full': signature_full,
-                    'cv_names': cv_names,
-                    'cv_info': cv_info_temp,
-                    'instance_names': [instance_name],
-                    'instance_count': 1
-                }
-
-                profile_lookup[signature_full] = profile_id
-
-        # Sort signatures alphabetically to ensure profile numbering independent of XML element order
-        sorted_signatures = sorted(profile_lookup.keys())
-
-        # Reassign profile IDs based on sorted signature order
-        final_profiles = {}
-        for idx, signature in enumerate(sorted_signatures, start=1):
-            old_profile_id = profile_lookup[signature]
-            new_profile_id = str(idx)
-
-            # Copy profile data with new deterministic ID
-            final_profiles[new_profile_id] = profiles[old_profile_id]
-
-        if DEBUG:
-            logging.debug(f'CV profiles for class {class_name}: {final_profiles}')
+    @staticmethod
+    def cv_signature_string(signature_full):
+        """
+        Canonical string form of a profile signature, e.g. 'current:float,enabled:bool'.
+        It's what the generated CTL builds from the CalculatedVariable elements of an instance
+        to find the profile of that instance: one 'name:type' item per element, duplicate names included,
+        the items sorted as strings (like dynSortAsc does).
+        """
+        return ','.join(sorted(f"{name}:{'bool' if is_boolean else 'float'}" for name, is_boolean in signature_full))
 
-        return final_profiles
+    def get_cv_profile_lookup(self, class_name):
+        """
+        Returns the profile ID of every CV profile of the class by its canonical signature string.
+        Format: {'current:float,enabled:bool': '1', 'current:float': '2', ...}
+        """
+        return {self.cv_signature_string(profile_data['signature_full']): profile_id
+                for profile_id, profile_data in self.get_cv_profiles_for_class(class_name).items()}
 
     def get_instance_cv_profile(self, class_name, instance_name):
         """
@@ -412,28 +801,10 @@ class ConfigInspector():
         - Exception if class or instance not found in configuration
         """
         # Validate instance exists (raises exception if class or instance not found)
-        instance = self._validate_instance_exists(class_name, instance_name)
+        self._validate_instance_exists(class_name, instance_name)
 
-        # Get all CV names for this instance
-        cv_elements = instance.xpath('./c:CalculatedVariable', namespaces=QUASAR_CONFIG_NAMESPACES)
-        cv_names = sorted([cv.get('name') for cv in cv_elements if cv.get('name')])
-
-        # Valid instance with no CVs - return None (normal operation)
-        if not cv_names:
-            return None
-
-        # Create signature and find matching profile
-        signature_full = tuple(cv_names)
-
-        # Get all profiles for this class
-        profiles = self.get_cv_profiles_for_class(class_name)
-
-        # Find the profile with matching signature
-        for profile_id, profile_data in profiles.items():
-            if profile_data['signature_full'] == signature_full:
-                return profile_id
-
-        return None
+        # Valid instance with no CVs gives None (normal operation)
+        return self._instance_profile_table(class_name)[instance_name]
 
     def get_all_cv_profiles(self):
         """
@@ -450,12 +821,106 @@ class ConfigInspector():
 
         # Get all unique parent classes that have calculated variables
         for class_name in self.calc_vars_by_class.keys():
-            profiles = self.get_cv_profiles_for_class(class_name)
-            if profiles:
-                all_profiles[class_name] = profiles
+            if class_name in self._profiles_by_class:
+                all_profiles[class_name] = self._profiles_by_class[class_name]
 
         return all_profiles
 
+    def get_top_level_instances(self):
+        """
+        Get the instances declared directly under the configuration element, in document order,
+        each with the size of its subtree (the number of elements it holds, itself included),
+        a measure of the work needed to configure it.
+
+        Returns:
+        [
+            {'class': 'ClassName', 'name': 'instanceName', 'weight': 42},
+            ...
+        ]
+        The name is None for instances declared without a name attribute.
+        """
+        return self._top_level_instances
+
+    def get_instances(self):
+        """
+        Get the named instances of the configuration, in document order, each with its full name
+        (the names of its ancestors and its own, separated by '/') and its CV profile ID (None without CVs).
+        Elements without a name attribute are not instances (see diff).
+
+        Returns:
+        [
+            {'name': 'sca1/ai1', 'class': 'AnalogInput', 'cv_profile': '1' or None},
+            ...
+        ]
+        """
+        return [{'name': full_name, 'class': class_name, 'cv_profile': profile_id}
+                for full_name, (class_name, _, profile_id) in self._named_instances().items()]
+
+    def _cv_profile_signature(self, class_name, profile_id):
+        if profile_id is None:
+            return None
+        return self._profiles_by_class[class_name][profile_id]['signature_full']
+
+    def _cv_profile_names(self, class_name, profile_id):
+        """Sorted CV names of a profile, [] for None"""
+        return [name for name, _ in self._cv_profile_signature(class_name, profile_id) or ()]
+
+    @staticmethod
+    def diff(old, new, configured_classes):
+        """
+        Compare the named instances of two ConfigInspectors, e.g. of two versions of a configuration file.
+        Instances are identified by their full name ('parentName/instanceName'); one whose class changed
+        counts as removed and added. Elements without a name attribute are content of their instance.
+        Only the instances parseConfig configures are compared: configured_classes(class_name) gives the classes
+        instantiated by configuration below a class (below Root for None), see
+        CachingDesignInspector.get_configured_classes. The other named elements of the new configuration
+        (FreeVariable, CalculatedVariableGenericFormula...) are listed as ignored.
+
+        Returns:
+        {
+            'added':    [{'name': 'sca1/ai3', 'class': 'AnalogInput', 'cv_profile': '2' or None}, ...],
+            'removed':  [{'name': 'sca2', 'class': 'SCA', 'cv_profile': '1' or None}, ...],
+            'modified': [{'name': 'sca1', 'class': 'SCA', 'old_cv_profile': '1' or None, 'cv_profile': '1' or None,
+                          'cv_profile_changed': True, 'old_cv_names': ['v1'], 'cv_names': ['v1', 'v2']}, ...],
+            'ignored':  ['sca1/fv1', ...]
+        }
+        in document order (of the old configuration for removed instances, of the new one otherwise).
+        Modified instances have different content (attributes, text or calculated variables, not counting
+        named children, which are compared on their own). cv_profile_changed is set when the instance changed
+        its CV profile DPT, or the CV signature of that DPT changed, so its CV profile DP needs to be recreated.
+        The profile IDs of old_cv_profile and cv_profile are those of the old and new inspector respectively;
+        old_cv_names and cv_names are the sorted CV names of the instance in either configuration.
+        """
+        def entry(full_name, record):
+            return {'name': full_name, 'class': record[0], 'cv_profile': record[2]}
+
+        old_instances = old._configured_instances(configured_classes)
+        new_instances = new._configured_instances(configured_classes)
+        added = []
+        modified = []
+        for full_name, record in new_instances.items():
+            old_record = old_instances.get(full_name)
+            if old_record is None or old_record[0] != record[0]:
+                added.append(entry(full_name, record))
+                continue
+            cv_profile_changed = (
+                old_record[2] != record[2]
+                or old._cv_profile_signature(old_record[0], old_record[2]) != new._cv_profile_signature(record[0], record[2]))
+            if cv_profile_changed or old_record[1] != record[1]:
+                modified.append({
+                    'name': full_name,
+                    'class': record[0],
+                    'old_cv_profile': old_record[2],
+                    'cv_profile': record[2],
+                    'cv_profile_changed': cv_profile_changed,
+                    'old_cv_names': old._cv_profile_names(old_record[0], old_record[2]),
+                    'cv_names': new._cv_profile_names(record[0], record[2])
+                })
+        removed = [entry(full_name, record) for full_name, record in old_instances.items()
+                   if new_instances.get(full_name, (None,))[0] != record[0]]
+        ignored = [full_name for full_name in new._named_instances() if full_name not in new_instances]
+        return {'added': added, 'removed': removed, 'modified': modified, 'ignored': ignored}
+
 if __name__ == "__main__":
     """Test fixture for manual testing and validation"""
     import sys
@@ -498,7 +963,7 @@ if __name__ == "__main__":
                 print(f"         CV Names: {', '.join(profile_data['cv_names'])}")
                 print(f"         Instance count: {profile_data['instance_count']}")
                 # Show first 3 instances
-                instances_str = ', '.join(profile_data['instance_names'][:3])
+                instances_str = ', '.join(profile_data['first_instance_names'])
                 if profile_data['instance_count'] > 3:
                     instances_str += f" ... (+{profile_data['instance_count'] - 3} more)"
                 print(f"         Instances: {instances_str}")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+DesignValidator.py
+
+Validation of the design for Cacophony in a single pass, which also resolves the DPEL type of every variable.
+'''
+
+from quasarExceptions import DesignFlaw
+
+ObviousMapping = {  # these are unanimously good choices
+    'OpcUa_Boolean' : "DPEL_BOOL",
+    'OpcUa_UInt32'  : "DPEL_UINT",
+    'OpcUa_Int32'   : "DPEL_INT",
+    'OpcUa_UInt64'  : "DPEL_ULONG",
+    'OpcUa_Int64'   : "DPEL_LONG",
+    'OpcUa_Float'   : "DPEL_FLOAT",
+    'OpcUa_Double'  : "DPEL_FLOAT",
+    'UaString'      : "DPEL_STRING",
+    'UaByteString'  : "DPEL_BLOB"
+    }
+
+LessObviousMapping = {
+    'OpcUa_Byte'    : 'DPEL_UINT',
+    'OpcUa_SByte'   : 'DPEL_INT',
+    'OpcUa_UInt16'  : 'DPEL_UINT',
+    'OpcUa_Int16'   : 'DPEL_INT'
+}
+
+ObviousMappingArray = {  # these are unanimously good choices
+    'OpcUa_Boolean' : "DPEL_DYN_BOOL",
+    'OpcUa_UInt32'  : "DPEL_DYN_UINT",
+    'OpcUa_Int32'   : "DPEL_DYN_INT",
+    'OpcUa_UInt64'  : "DPEL_DYN_ULONG",
+    'OpcUa_Int64'   : "DPEL_DYN_LONG",
+    'OpcUa_Float'   : "DPEL_DYN_FLOAT",
+    'OpcUa_Double'  : "DPEL_DYN_FLOAT",
+    'UaString'      : "DPEL_DYN_STRING",
+    'UaByteString'  : "DPEL_DYN_BLOB"
+    }
+
+LessObviousMappingArray = {
+    'OpcUa_Byte'    : 'DPEL_DYN_UINT',
+    'OpcUa_SByte'   : 'DPEL_DYN_INT',
+    'OpcUa_UInt16'  : 'DPEL_DYN_UINT',
+    'OpcUa_Int16'   : 'DPEL_DYN_INT'
+}
+
+FLOAT_EXPLANATION = ("Scalar writable variables of type OpcUa_Float have no direct correspondence in WinCC OA "
+                     "and cause problems especially when writing from WinCC OA. "
+                     "Please convert these variables to OpcUa_Double data-type.")
+
+def dpel_type(quasar_data_type, is_array):
+    """
+    (DPEL constant, exact) of a quasar data type, exact being False for the less obvious choices
+    of types without a WinCC OA counterpart; None for unsupported data types
+    """
+    if quasar_data_type in ObviousMapping:
+        return (ObviousMappingArray if is_array else ObviousMapping)[quasar_data_type], True
+    if quasar_data_type in LessObviousMapping:
+        return (LessObviousMappingArray if is_array else LessObviousMapping)[quasar_data_type], False
+    return None
+
+class DesignValidator():
+    """
+    Walks every class of the design once and collects all of its problems for Cacophony:
+    - errors: scalar writable OpcUa_Float variables, data types without a DPEL mapping,
+      source variables neither readable nor writable,
+    - warnings: less obvious data type mappings, source variable arrays and methods (both left out of the DPTs).
+    dpel_types holds the DPEL type constant of every variable making it into the DPTs,
+    as {class_name: {variable_name: 'DPEL_...'}}, for templates to look up.
+    """
+
+    def __init__(self, design_inspector):
+        self.errors = []
+        self.warnings = []
+        self.dpel_types = {}
+        self.variable_count = 0
+        self._has_float_variables = False
+        self.class_names = design_inspector.get_names_of_all_classes()
+        for class_name in self.class_names:
+            self._validate_class(class_name, design_inspector.objectify_class(class_name))
+
+    def _validate_class(self, class_name, cls):
+        types = self.dpel_types.setdefault(class_name, {})
+        # objectified children which are absent raise AttributeError, hence getattr
+        for cv in getattr(cls, 'cachevariable', ()):
+            self._validate_variable(class_name, cv, 'cache-var', types)
+        for sv in getattr(cls, 'sourcevariable', ()):
+            if len(getattr(sv, 'array', ())) > 0:
+                self.warnings.append(f"{class_name}/{sv.get('name')}(source-var): source variable arrays are not "
+                                     "supported by Cacophony yet, the variable is skipped")
+                continue
+            if sv.get('addressSpaceRead') == 'forbidden' and sv.get('addressSpaceWrite') == 'forbidden':
+                self.errors.append(f"{class_name}/{sv.get('name')}(source-var): can be neither read nor written, "
+                                   "its address can't be mapped")
+            self._validate_variable(class_name, sv, 'source-var', types)
+        methods = getattr(cls, 'method', ())
+        if len(methods) > 0:
+            self.warnings.append(f"{class_name}: has {len(methods)} method(s) but there is no method support "
+                                 "in WinCC OA, skipping")
+
+    def _validate_variable(self, class_name, variable, kind, types):
+        self.variable_count += 1
+        where = f"{class_name}/{variable.get('name')}({kind})"
+        data_type = variable.get('dataType')
+        is_array = len(getattr(variable, 'array', ())) > 0
+        if (data_type == 'OpcUa_Float' and not is_array
+                and variable.get('addressSpaceWrite') not in (None, 'forbidden')):
+            self.errors.append(f"{where}: scalar writable variable of type OpcUa_Float")
+            self._has_float_variables = True
+        mapping = dpel_type(data_type, is_array)
+        if mapping is None:
+            self.errors.append(f"{where}: the quasar data type '{data_type}' is not yet supported in Cacophony")
+            return
+        types[variable.get('name')], exact = mapping
+        if not exact:
+            self.warnings.append(f"{where}: mapped {data_type} to {types[variable.get('name')]}, "
+                                 "because of no corresponding type in WinCC OA")
+
+    def report(self):
+        """All the errors and warnings as human-readable lines"""
+        lines = [f"  ERROR: {error}" for error in self.errors] + [f"  WARNING: {warning}" for warning in self.warnings]
+        return '\n'.join(lines)
+
+    def raise_on_errors(self):
+        """Raises DesignFlaw listing every error found, if any"""
+        if self.errors:
+            message = f"ERROR: the design has {len(self.errors)} problem(s) Cacophony can't handle:\n" + '\n'.join(
+                f"  {error}" for error in self.errors)
+            if self._has_float_variables:
+                message += '\n' + FLOAT_EXPLANATION
+            raise DesignFlaw(message)
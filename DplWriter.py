@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+DplWriter.py
+
+Writes a WinCC OA ASCII manager import file (.dpl) holding the datapoints and OPC UA address configs
+parseConfig would create for a whole configuration file, for commissioning a server in one bulk import.
+The DP IDs of the file are numbered from 1, so it may only be imported into an empty system: in a system with
+datapoints already, they would collide with the IDs of existing ones.
+'''
+
+import re
+
+# Values of the WinCC OA constants used by the generated CTL
+DPCONFIG_DISTRIBUTION_INFO = 56
+DPCONFIG_PERIPH_ADDR_MAIN = 16
+DPATTR_ADDR_MODE_INPUT_SPONT = 2
+DPATTR_ADDR_MODE_INPUT_SQUERY = 3
+DPATTR_ADDR_MODE_OUTPUT_SINGLE = 5
+DPATTR_ADDR_MODE_IO_SPONT = 6
+DPATTR_ADDR_MODE_IO_SQUERY = 8
+# Like fwPeriphAddress_setOPCUA as called by the generated CTL: kind 1, variant 1, datatype 750 (default)
+OPCUA_KIND = 1
+OPCUA_VARIANT = 1
+OPCUA_DATATYPE = 750
+
+MANAGER_USER = 'ASC (1)/0'
+NO_TIME = '01.01.1970 00:00:00.000'
+
+def cache_variable_mode(cv):
+    """Address mode of a cache variable, as in cache_variable_address_space_write_to_mode of the templates"""
+    if cv.get('addressSpaceWrite') == 'forbidden':
+        return DPATTR_ADDR_MODE_INPUT_SPONT
+    return DPATTR_ADDR_MODE_IO_SPONT
+
+def source_variable_mode(sv):
+    """Address mode of a source variable, as in source_variable_address_space_mode_to_mode of the templates"""
+    readable = sv.get('addressSpaceRead') != 'forbidden'
+    writable = sv.get('addressSpaceWrite') != 'forbidden'
+    if readable and writable:
+        return DPATTR_ADDR_MODE_IO_SQUERY
+    if readable:
+        return DPATTR_ADDR_MODE_INPUT_SQUERY
+    if writable:
+        return DPATTR_ADDR_MODE_OUTPUT_SINGLE
+    raise Exception(f"ERROR: source variable {sv.get('name')} can be neither read nor written, its address can't be mapped")
+
+def parse_address_active(specifications):
+    """
+    Turns 'ClassName=regex' specifications (the --address_active option) into {'ClassName': regex},
+    the Python counterpart of the addressActiveControl mapping of the generated CTL
+    """
+    address_active = {}
+    for specification in specifications or []:
+        class_name, separator, regex = specification.partition('=')
+        if not separator or not class_name:
+            raise Exception(f"ERROR: --address_active expects ClassName=regex, got: {specification}")
+        try:
+            address_active[class_name] = re.compile(regex)
+        except re.error as e:
+            raise Exception(f"ERROR: the regular expression of --address_active {specification} is wrong: {e}")
+    return address_active
+
+class DplWriter():
+    """
+    Produces the datapoints of a configuration - the configured instances, the design-instantiated
+    objects below them and the CV profile DPs - with the distribution and address configs of all their DPEs,
+    exactly like parseConfig of the generated configParser.ctl sets them up (with no prefix).
+    """
+
+    def __init__(self, design_inspector, config_inspector, type_prefix, server_name, driver_number,
+                 subscription_name, address_active=None):
+        """
+        design_inspector: the CachingDesignInspector of the rendering (see get_configured_classes).
+        address_active: {'ClassName': compiled regex} (see parse_address_active); the addresses of the variables
+                        of a listed class are active only when the variable name fully matches the regex.
+                        Classes of CV profile DPs are named ClassName_CV<profile ID>.
+        """
+        self.design_inspector = design_inspector
+        self.config_inspector = config_inspector
+        self.type_prefix = type_prefix
+        self.server_name = server_name
+        self.driver_number = driver_number
+        self.subscription_name = subscription_name
+        self.address_active = address_active or {}
+        self._class_elements = {}
+
+    def _elements_of_class(self, class_name):
+        """[(element_name, address_mode), ...] of the DPT of a class, with the DPEs createDpt<Class> creates"""
+        if class_name not in self._class_elements:
+            # objectified children which are absent raise AttributeError, hence getattr
+            cls = self.design_inspector.objectify_class(class_name)
+            elements = [(cv.get('name'), cache_variable_mode(cv)) for cv in getattr(cls, 'cachevariable', ())]
+            # like in the DPTs, there is no support for source variable arrays
+            elements += [(sv.get('name'), source_variable_mode(sv)) for sv in getattr(cls, 'sourcevariable', ())
+                         if len(getattr(sv, 'array', ())) == 0]
+            self._class_elements[class_name] = elements
+        return self._class_elements[class_name]
+
+    def _design_instantiated(self, class_name, full_name):
+        """(full_name, class_name) of the design-instantiated objects below an object, recursively"""
+        for ho in self.design_inspector.objectify_has_objects(class_name, "[@instantiateUsing='design']"):
+            for obj in getattr(ho, 'object', ()):
+                child_name = full_name + '/' + obj.get('name')
+                yield child_name, ho.get('class')
+                yield from self._design_instantiated(ho.get('class'), child_name)
+
+    def datapoints(self):
+        """
+        Yields (dp_name, dpt_name, active_class, address_base, elements) of every datapoint, in configuration order:
+        the addresses of the elements are address_base.element_name, active_class selects the address_active regex.
+        """
+        included = {}  # configured instances parseConfig reaches: {full_name: class_name}
+        for instance in self.config_inspector.get_instances():
+            full_name, class_name = instance['name'], instance['class']
+            parent_name = full_name.rpartition('/')[0]
+            if parent_name and parent_name not in included:
+                continue
+            if class_name not in self.design_inspector.get_configured_classes(included.get(parent_name)):
+                continue
+            included[full_name] = class_name
+
+            yield full_name, self.type_prefix + class_name, class_name, full_name, self._elements_of_class(class_name)
+            if instance['cv_profile'] is not None:
+                profile_class = f"{class_name}_CV{instance['cv_profile']}"
+                profile = self.config_inspector.get_cv_profiles_for_class(class_name)[instance['cv_profile']]
+                yield (full_name + '_CV', self.type_prefix + profile_class, profile_class, full_name,
+                       [(cv_name, DPATTR_ADDR_MODE_INPUT_SPONT) for cv_name in profile['cv_names']])
+            for child_name, child_class in self._design_instantiated(class_name, full_name):
+                yield child_name, self.type_prefix + child_class, child_class, child_name, self._elements_of_class(child_class)
+
+    def is_active(self, active_class, element_name):
+        regex = self.address_active.get(active_class)
+        return regex is None or regex.fullmatch(element_name) is not None
+
+    def write(self, output_path):
+        """
+        Write the import file; returns the number of datapoints written.
+        Their IDs are numbered from 1, in configuration order: the file is for an empty system only.
+        """
+        driver = f'\\{self.driver_number}'
+        dp_count = 0
+        with open(output_path, mode='w', encoding='utf-8') as dpl:
+            dpl.write('# ascii dump of database\n')
+
+            dpl.write('\n# Datapoint/DpId\n')
+            dpl.write('DpName\tTypeName\tID\n')
+            for dp_name, dpt_name, _, _, _ in self.datapoints():
+                dp_count += 1
+                dpl.write(f'{dp_name}\t{dpt_name}\t{dp_count}\n')
+
+            dpl.write('\n# DistributionInfo\n')
+            dpl.write('Manager/User\tElementName\tTypeName\t_distrib.._type\t_distrib.._driver\n')
+            for dp_name, dpt_name, _, _, elements in self.datapoints():
+                for element_name, _ in elements:
+                    dpl.write(f'{MANAGER_USER}\t{dp_name}.{element_name}\t{dpt_name}\t'
+                              f'{DPCONFIG_DISTRIBUTION_INFO}\t{driver}\n')
+
+            dpl.write('\n# PeriphAddrMain\n')
+            dpl.write('Manager/User\tElementName\tTypeName\t_address.._type\t_address.._reference\t'
+                      '_address.._poll_group\t_address.._connection\t_address.._offset\t_address.._subindex\t'
+                      '_address.._direction\t_address.._internal\t_address.._lowlevel\t_address.._active\t'
+                      '_address.._start\t_address.._interval\t_address.._reply\t_address.._datatype\t'
+                      '_address.._drv_ident\n')
+            for dp_name, dpt_name, active_class, address_base, elements in self.datapoints():
+                for element_name, mode in elements:
+                    address = f'{address_base}.{element_name}'.replace('/', '.')
+                    # synchronous (query) modes go without subscription
+                    subscription = '' if mode in (DPATTR_ADDR_MODE_IO_SQUERY, DPATTR_ADDR_MODE_INPUT_SQUERY) else self.subscription_name
+                    reference = f'{self.server_name}${subscription}${OPCUA_KIND}${OPCUA_VARIANT}$ns=2;s={address}'
+                    active = 1 if self.is_active(active_class, element_name) else 0
+                    dpl.write(f'{MANAGER_USER}\t{dp_name}.{element_name}\t{dpt_name}\t{DPCONFIG_PERIPH_ADDR_MAIN}\t'
+                              f'"{reference}"\t""\t""\t0\t0\t\\{mode}\t0\t0\t{active}\t'
+                              f'{NO_TIME}\t{NO_TIME}\t{NO_TIME}\t{OPCUA_DATATYPE}\t"OPCUA"\n')
+        return dp_count
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+GenerationPipeline.py
+
+Renders all Cacophony templates from a single parse of the design.
+'''
+
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import jinja2
+from colorama import Fore, Style
+
+from DesignInspector import DesignInspector
+from CachingDesignInspector import CachingDesignInspector
+from PhaseProfiler import PhaseProfiler
+
+# we use template_debug to keep the debug() available to templates identical to the one of quasar transforms
+from transform_filters import template_debug
+
+# Log levels of the generated CTL, from the most to the least verbose
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+# The pipeline of a worker process of GenerationPipeline.render_all()
+_worker_pipeline = None
+
+# Characters escaped inside CTL string literals
+CTL_STRING_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+def ctl_string(value):
+    """The ctl_string filter: value escaped to go between the double quotes of a CTL string literal"""
+    return ''.join(CTL_STRING_ESCAPES.get(character, character) for character in str(value))
+
+class GenerationPipeline():
+    """
+    Holds one DesignInspector and one Jinja2 environment and renders every Cacophony output from them,
+    so the design is parsed (and validated) once per run instead of once per template.
+    """
+
+    def __init__(self, design_xml_path, templates_path, additional_params):
+        """
+        design_xml_path: the design file (Design.xml or a merged DesignWithMeta.xml)
+        templates_path: directory holding the Cacophony templates
+        additional_params: dict of extra names passed to every template render
+        """
+        self.design_xml_path = design_xml_path
+        self.templates_path = templates_path
+        # Templates repeat the same design queries in nested loops and across outputs, hence the caching facade
+        self.design_inspector = CachingDesignInspector(DesignInspector(design_xml_path))
+        self.environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(templates_path),
+            trim_blocks=True,
+            lstrip_blocks=True)
+        self.environment.globals['debug'] = template_debug
+        self.environment.globals['log_enabled'] = self.log_enabled
+        self.environment.filters['ctl_string'] = ctl_string
+        self.additional_params = additional_params
+
+    def log_enabled(self, level):
+        """
+        Whether the generated code keeps its log statements of the given level:
+        those below the 'logLevel' additional parameter (default DEBUG, i.e. everything) are left out at generation time.
+        """
+        threshold = self.additional_params.get('logLevel', LOG_LEVELS[0])
+        return LOG_LEVELS.index(level) >= LOG_LEVELS.index(threshold)
+
+    def render(self, template_name, output_path, astyle_run=True, profiler=None, parameters=None):
+        """
+        Render the given template into output_path and optionally format it with astyle;
+        profiler: optional PhaseProfiler recording the rendering and the formatting as phases;
+        parameters: optional dict overriding some additional_params for this output (e.g. those of one server)
+        """
+        if profiler is None:
+            profiler = PhaseProfiler(enabled=False)
+        template_params = dict(self.additional_params, **parameters) if parameters else self.additional_params
+        with profiler.phase('render ' + template_name) as counts:
+            template = self.environment.get_template(template_name)
+            output = template.render(designInspector=self.design_inspector, **template_params)
+
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, mode='w', encoding='utf-8') as output_file:
+                output_file.write(output)
+            counts['output_bytes'] = os.path.getsize(output_path)
+        print(Fore.GREEN + f"Generated: {output_path}" + Style.RESET_ALL)
+
+        if astyle_run:
+            with profiler.phase('astyle ' + os.path.basename(output_path)):
+                run_astyle(output_path)
+
+    def render_all(self, outputs, jobs=1, astyle_run=True, profiler=None):
+        """
+        Render (and format) every (template_name, output_path) pair of outputs; an output may come with
+        a third element, the parameters overriding additional_params for it (see render()).
+        With jobs > 1 the outputs are rendered and formatted concurrently in a pool of that many processes;
+        an exception raised in a worker is re-raised here, the phases recorded in the workers are added to profiler.
+        """
+        if profiler is None:
+            profiler = PhaseProfiler(enabled=False)
+        if jobs <= 1:
+            for template_name, output_path, *parameters in outputs:
+                self.render(template_name, output_path, astyle_run, profiler, *parameters)
+            return
+
+        global _worker_pipeline
+        # Forked workers inherit this pipeline as it is; the others build their own in _init_worker
+        _worker_pipeline = self
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=min(jobs, len(outputs)),
+                    initializer=_init_worker,
+                    initargs=(self.design_xml_path, self.templates_path, self.additional_params)) as pool:
+                futures = [pool.submit(_render_in_worker, template_name, output_path, astyle_run, profiler.enabled,
+                                       *parameters)
+                           for template_name, output_path, *parameters in outputs]
+                for future in futures:
+                    profiler.extend(future.result())
+        finally:
+            _worker_pipeline = None
+
+def _init_worker(design_xml_path, templates_path, additional_params):
+    global _worker_pipeline
+    if _worker_pipeline is None:
+        _worker_pipeline = GenerationPipeline(design_xml_path, templates_path, additional_params)
+
+def _render_in_worker(template_name, output_path, astyle_run, profile, parameters=None):
+    """Returns the phases recorded while rendering when profile is set"""
+    profiler = PhaseProfiler(enabled=profile)
+    _worker_pipeline.render(template_name, output_path, astyle_run, profiler, parameters)
+    return profiler.phases
+
+def run_astyle(path):
+    """Format the given file in place with astyle; warns and leaves the file as is when astyle is not installed"""
+    if shutil.which('astyle') is None:
+        print(Fore.YELLOW + f"WARNING: 'astyle' not found, {path} will not be formatted" + Style.RESET_ALL)
+        return
+    subprocess.run(['astyle', '--quiet', '--suffix=none', path], check=True)
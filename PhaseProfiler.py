@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+PhaseProfiler.py
+
+Wall time, CPU time and peak memory of the phases of a generation run (generateStuff.py --profile).
+'''
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# resource is POSIX-only; on Windows the peak memory comes from psutil when it is installed, or isn't measured
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# ru_maxrss is in kB on Linux, in bytes on macOS
+RU_MAXRSS_PER_MB = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+def _cpu_time():
+    """
+    CPU time (user and system) of this process and of its terminated children, e.g. xmllint and astyle;
+    of this process alone without resource
+    """
+    if resource is None:
+        return time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, None when it can't be measured on this platform"""
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / RU_MAXRSS_PER_MB
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        # peak_wset is the peak working set on Windows; elsewhere only the current RSS is known
+        return getattr(memory_info, 'peak_wset', memory_info.rss) / (1024 * 1024)
+    return None
+
+def _round_mb(value):
+    return None if value is None else round(value, 1)
+
+def _format_mb(value):
+    return 'n/a' if value is None else f'{value:.1f}'
+
+class PhaseProfiler():
+    """
+    Records the phases entered with phase(), which may be nested. Per phase:
+    - wall_s, cpu_s: wall and CPU time, the CPU time including the child processes run during the phase,
+    - peak_rss_mb: the peak resident memory of the process at the end of the phase,
+    - rss_growth_mb: how much the phase raised that peak (both None where it can't be measured, see peak_rss_mb),
+    - counts: whatever the caller attaches (numbers of classes, instances, output bytes...).
+    A disabled profiler records nothing, so that instrumented code needs no conditions.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = []
+        self._depth = 0
+
+    @contextmanager
+    def phase(self, name, **counts):
+        """
+        Context manager timing the enclosed block as phase name; yields the dict of counts of the phase,
+        which can be completed inside the block
+        """
+        if not self.enabled:
+            yield {}
+            return
+        record = {'name': name, 'depth': self._depth, 'pid': os.getpid(), 'counts': dict(counts)}
+        # recorded at entry, so that nested phases come after the phase they belong to
+        self.phases.append(record)
+        self._depth += 1
+        rss_before = peak_rss_mb()
+        wall_before = time.perf_counter()
+        cpu_before = _cpu_time()
+        try:
+            yield record['counts']
+        finally:
+            self._depth -= 1
+            peak_rss = peak_rss_mb()
+            record['wall_s'] = round(time.perf_counter() - wall_before, 4)
+            record['cpu_s'] = round(_cpu_time() - cpu_before, 4)
+            record['peak_rss_mb'] = _round_mb(peak_rss)
+            record['rss_growth_mb'] = _round_mb(None if peak_rss is None else peak_rss - rss_before)
+
+    def extend(self, phases):
+        """Add the phases recorded by another profiler (e.g. of a worker process) as nested in the current phase"""
+        if not self.enabled:
+            return
+        for record in phases:
+            self.phases.append(dict(record, depth=record['depth'] + self._depth))
+
+    def format_table(self):
+        """Returns the phases as a human-readable table"""
+        lines = ['  {0:56} {1:>10} {2:>10} {3:>12} {4:>12}  {5}'.format(
+            'phase', 'wall [s]', 'CPU [s]', 'peak RSS [MB]', 'RSS growth', 'counts')]
+        for record in self.phases:
+            name = '  ' * record['depth'] + record['name']
+            if record['pid'] != os.getpid():
+                name += f' (pid {record["pid"]})'
+            lines.append('  {0:56} {1:10.3f} {2:10.3f} {3:>12} {4:>12}  {5}'.format(
+                name, record['wall_s'], record['cpu_s'], _format_mb(record['peak_rss_mb']),
+                _format_mb(record['rss_growth_mb']),
+                ', '.join(f'{key}={value}' for key, value in record['counts'].items())))
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        """Write the phases as a JSON report"""
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'argv': sys.argv,
+            'phases': self.phases
+        }
+        with open(path, mode='w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=1)
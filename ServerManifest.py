@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+ServerManifest.py
+
+The servers one generateStuff.py run generates for: a single server (--config_file), one server per
+configuration file (--config_files) or the servers listed in a manifest (--manifest).
+'''
+
+import json
+import os
+
+# Settings a server of a manifest may override, with the template parameters they set
+SERVER_SETTINGS = {
+    'dpt_prefix'      : 'typePrefix',
+    'server_name'     : 'serverName',
+    'driver_number'   : 'driverNumber',
+    'subscription'    : 'subscriptionName',
+    'function_prefix' : 'functionPrefix'
+    }
+
+# Keys of a server of a manifest besides the settings
+SERVER_KEYS = ('name', 'config_file', 'previous_config_file')
+
+class Server():
+    """
+    One server to generate for:
+    - name: the name of its output directory under generated/, None for the single server of a plain run
+      (written to generated/ itself),
+    - config_file_path, previous_config_file_path: its configuration file and the previous version of it
+      (--previous_config_file), either may be None,
+    - parameters: the template parameters it overrides (serverName, driverNumber...).
+    The rest is filled in by generateStuff.py during the run: the parameters its outputs are built with (as
+    recorded in the build cache), the outputs still to generate, the path of the .dpl file to write (None: none),
+    the inspectors of its configuration files and the differences between them.
+    """
+
+    def __init__(self, name, output_dir, config_file_path, previous_config_file_path=None, parameters=None):
+        self.name = name
+        self.output_dir = output_dir
+        self.config_file_path = config_file_path
+        self.previous_config_file_path = previous_config_file_path
+        self.parameters = parameters or {}
+        self.build_parameters = None
+        self.outputs = []
+        self.dpl_path = None
+        self.config_inspector = None
+        self.previous_config_inspector = None
+        self.config_diff = None
+
+    def label(self):
+        """How the server is referred to in messages"""
+        return f"server '{self.name}'" if self.name else 'the server'
+
+def servers_from_config_files(config_files, config_dir, generated_path):
+    """One server per configuration file (relative to config_dir), named after the file, with the default settings"""
+    return _checked([Server(os.path.splitext(os.path.basename(config_file))[0], None,
+                            os.path.join(config_dir, config_file))
+                     for config_file in config_files], generated_path)
+
+def servers_from_manifest(manifest_path, config_dir, generated_path):
+    """
+    The servers listed in a JSON manifest:
+        {"servers": [{"config_file": "atlas-a.xml", "server_name": "ATLAS_A", "driver_number": "12"}, ...]}
+    config_file (relative to config_dir, like --config_file) is mandatory; name (of the output directory,
+    default: the configuration file name without extension), previous_config_file and the settings of
+    SERVER_SETTINGS are optional, the settings defaulting to the command line ones.
+    """
+    try:
+        with open(manifest_path, mode='r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except ValueError as exception:
+        raise Exception(f"ERROR: manifest {manifest_path} is not valid JSON: {exception}")
+    entries = manifest.get('servers') if isinstance(manifest, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise Exception(f"ERROR: manifest {manifest_path} needs a non-empty 'servers' list")
+    servers = []
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict) or 'config_file' not in entry:
+            raise Exception(f"ERROR: server #{position} of manifest {manifest_path} has no 'config_file'")
+        unknown_keys = set(entry) - set(SERVER_KEYS) - set(SERVER_SETTINGS)
+        if unknown_keys:
+            raise Exception("ERROR: server #{0} of manifest {1} has unknown key(s) {2}, known ones are {3}".format(
+                position, manifest_path, ', '.join(sorted(unknown_keys)), ', '.join(SERVER_KEYS + tuple(SERVER_SETTINGS))))
+        previous_config_file = entry.get('previous_config_file')
+        parameters = {SERVER_SETTINGS[key]: str(value) for key, value in entry.items() if key in SERVER_SETTINGS}
+        if previous_config_file:
+            parameters['previousConfigFile'] = previous_config_file
+        servers.append(Server(
+            str(entry.get('name') or os.path.splitext(os.path.basename(entry['config_file']))[0]),
+            None,
+            os.path.join(config_dir, entry['config_file']),
+            os.path.join(config_dir, previous_config_file) if previous_config_file else None,
+            parameters))
+    return _checked(servers, generated_path)
+
+def _checked(servers, generated_path):
+    """Places the output directories of the servers under generated_path, which must be distinct"""
+    names = set()
+    for server in servers:
+        if not server.name or server.name != os.path.basename(server.name) or server.name.startswith('.'):
+            raise Exception(f"ERROR: '{server.name}' can't be the name of the output directory of a server")
+        if server.name in names:
+            raise Exception(f"ERROR: two servers are named '{server.name}', give them distinct names")
+        names.add(server.name)
+        server.output_dir = os.path.join(generated_path, server.name)
+    return servers
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+run_benchmarks.py
+
+Times and memory-profiles ConfigInspector and the template renders on synthetic projects (see synthetic.py)
+of increasing size, writes the results as JSON and optionally compares them with a baseline.
+
+Run it from the top directory of a quasar project, like generateStuff.py (the renders need quasar's
+FrameworkInternals; without them only the ConfigInspector benchmarks run):
+    python3 Cacophony/benchmarks/run_benchmarks.py --sizes 1000 10000 100000 --output results.json
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from colorama import Fore, Style
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+cacophony_root = os.path.dirname(benchmarks_path)
+sys.path.insert(0, cacophony_root)
+sys.path.insert(0, 'FrameworkInternals')
+
+from synthetic import generate_project
+from ConfigInspector import ConfigInspector
+from PhaseProfiler import peak_rss_mb
+
+# Differences below these are measurement noise, never regressions
+NOISE_FLOOR = {'wall_s': 0.01, 'peak_rss_mb': 2.0}
+
+TEMPLATES = ('designToDptCreation.jinja', 'designToConfigParser.jinja', 'designToInstantiationFromDesign.jinja')
+
+def _renders_available():
+    try:
+        import DesignInspector  # noqa: F401 (quasar's FrameworkInternals)
+        return True
+    except ImportError:
+        return False
+
+class Stopwatch():
+    """Wall and CPU time of the with-block"""
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+
+    def result(self):
+        return {'wall_s': round(self.wall, 4), 'cpu_s': round(self.cpu, 4)}
+
+def bench_config_inspector(config_path, streaming, use_xmllint):
+    with Stopwatch() as stopwatch:
+        inspector = ConfigInspector(config_path, streaming=streaming, use_xmllint=use_xmllint)
+    return dict(stopwatch.result(),
+                instances=len(inspector.get_instances()),
+                cv_profiles=sum(len(profiles) for profiles in inspector.get_all_cv_profiles().values()))
+
+def bench_all_cv_profiles(config_path):
+    inspector = ConfigInspector(config_path)
+    with Stopwatch() as stopwatch:
+        profiles = inspector.get_all_cv_profiles()
+    return dict(stopwatch.result(), cv_profiles=sum(len(class_profiles) for class_profiles in profiles.values()))
+
+def bench_render(project_dir, config_path, template_name):
+    from GenerationPipeline import GenerationPipeline
+    from DesignValidator import DesignValidator
+    additional_params = {
+        'typePrefix'       : 'Quasar',
+        'serverName'       : 'QUASAR_SERVER',
+        'driverNumber'     : '69',
+        'subscriptionName' : 'MyQuasarSubscription',
+        'functionPrefix'   : '',
+        'addressBatchSize' : 0,
+        'logLevel'         : 'DEBUG',
+        'runtimeStats'     : False,
+        'workerThreads'    : 0,
+        'configInspector'  : ConfigInspector(config_path)}
+    pipeline = GenerationPipeline(os.path.join(project_dir, 'Design', 'Design.xml'),
+                                  os.path.join(cacophony_root, 'templates'),
+                                  additional_params)
+    additional_params['dpelTypes'] = DesignValidator(pipeline.design_inspector).dpel_types
+    output_path = os.path.join(project_dir, 'generated', template_name + '.ctl')
+    with Stopwatch() as stopwatch:
+        pipeline.render(template_name, output_path, astyle_run=False)
+    return dict(stopwatch.result(), output_bytes=os.path.getsize(output_path))
+
+def _measure(function, args):
+    """
+    Runs in a fresh process, so that the peak RSS is the one of this benchmark alone
+    (None where it can't be measured, see PhaseProfiler.peak_rss_mb)
+    """
+    rss_before = peak_rss_mb()
+    result = function(*args)
+    rss_peak = peak_rss_mb()
+    result['peak_rss_mb'] = None if rss_peak is None else round(rss_peak, 1)
+    result['rss_growth_mb'] = None if rss_peak is None else round(rss_peak - rss_before, 1)
+    return result
+
+def measure(function, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(_measure, function, args).result()
+
+def run(sizes, profile_count, entity_file_count, with_renders):
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix='cacophony_bench_') as project_dir:
+            config_path = generate_project(project_dir, size, profile_count, entity_file_count)
+            benchmarks = [
+                ('config_inspector_tree', bench_config_inspector, (config_path, False, False)),
+                ('config_inspector_streaming', bench_config_inspector, (config_path, True, False)),
+                ('get_all_cv_profiles', bench_all_cv_profiles, (config_path,))]
+            if with_renders:
+                benchmarks += [(f'render_{template_name}', bench_render, (project_dir, config_path, template_name))
+                               for template_name in TEMPLATES]
+            for name, function, args in benchmarks:
+                result = dict({'benchmark': name, 'size': size}, **measure(function, *args))
+                peak_rss = 'n/a' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.1f}"
+                print(Fore.BLUE + '  {benchmark:50} {size:>9} instances: {wall_s:9.3f} s wall, {cpu_s:9.3f} s CPU, '
+                      '{0:>8} MB peak RSS'.format(peak_rss, **result) + Style.RESET_ALL)
+                results.append(result)
+    return results
+
+def compare(results, baseline_path, tolerance):
+    """Regressions (wall time or peak RSS beyond tolerance) with respect to the results in baseline_path"""
+    with open(baseline_path, mode='r', encoding='utf-8') as baseline_file:
+        baseline = {(result['benchmark'], result['size']): result for result in json.load(baseline_file)['results']}
+    regressions = []
+    for result in results:
+        reference = baseline.get((result['benchmark'], result['size']))
+        if reference is None:
+            continue
+        for metric, noise_floor in NOISE_FLOOR.items():
+            if result[metric] is None or reference[metric] is None:
+                continue  # not measured on the platform of either run
+            if (result[metric] > reference[metric] * (1 + tolerance)
+                    and result[metric] - reference[metric] > noise_floor):
+                regressions.append('{0} ({1} instances): {2} went from {3} to {4}'.format(
+                    result['benchmark'], result['size'], metric, reference[metric], result[metric]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ConfigInspector and the template renders of Cacophony")
+    parser.add_argument("--sizes", dest="sizes", type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Numbers of configured instances of the synthetic projects (up to 1000000 and beyond)")
+    parser.add_argument("--cv_profiles", dest="cv_profiles", type=int, default=16,
+                        help="Number of distinct calculated variable profiles in the synthetic configurations")
+    parser.add_argument("--entity_files", dest="entity_files", type=int, default=4,
+                        help="Number of files the synthetic configurations are spread over")
+    parser.add_argument("--no_renders", dest="no_renders", action="store_true",
+                        help="Only benchmark ConfigInspector")
+    parser.add_argument("--output", dest="output", default="benchmark_results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--baseline", dest="baseline", default=None,
+                        help="JSON results of a previous run; exits with 1 when a benchmark regressed")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.2,
+                        help="Relative slowdown or memory growth over the baseline tolerated (default 0.2)")
+    args = parser.parse_args()
+
+    with_renders = not args.no_renders
+    if with_renders and not _renders_available():
+        print(Fore.YELLOW + "WARNING: quasar's FrameworkInternals not found (run from a quasar project), "
+              "skipping the render benchmarks" + Style.RESET_ALL)
+        with_renders = False
+
+    results = run(args.sizes, args.cv_profiles, args.entity_files, with_renders)
+    import lxml.etree
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'lxml': '.'.join(map(str, lxml.etree.LXML_VERSION)),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        },
+        'results': results
+    }
+    with open(args.output, mode='w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=1)
+    print(Fore.GREEN + f"Results written to {args.output}" + Style.RESET_ALL)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print(Fore.RED + "Regressions:\n  " + '\n  '.join(regressions) + Style.RESET_ALL)
+            sys.exit(1)
+        print(Fore.GREEN + "No regression with respect to " + args.baseline + Style.RESET_ALL)
+
+if __name__ == "__main__":
+    main()
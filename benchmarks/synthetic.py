@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+'''
+synthetic.py
+
+Generates synthetic quasar projects (Design.xml and configuration files) of a given size for benchmarking Cacophony.
+
+The design has nested hasobjects mixing configuration and design instantiation:
+    root -> Crate (configuration) -> Board (configuration) -> Channel (configuration)
+                                                           -> Sensor (design, sensorA/sensorB)
+    root -> Monitor (design, monitor0)
+Channels carry calculated variables, from a pool of CV profiles (distinct sets of CVs).
+Crates are spread over external entity files included by the main configuration file.
+'''
+
+import argparse
+import math
+import os
+
+DESIGN_NAMESPACE = 'http://cern.ch/quasar/Design'
+CONFIG_NAMESPACE = 'http://cern.ch/quasar/Configuration'
+
+BOARDS_PER_CRATE = 10
+CHANNELS_PER_BOARD = 8
+# Crate, its boards and their channels
+INSTANCES_PER_CRATE = 1 + BOARDS_PER_CRATE * (1 + CHANNELS_PER_BOARD)
+
+DESIGN = '''<?xml version="1.0" encoding="UTF-8"?>
+<d:design xmlns:d="{namespace}" projectShortName="Synthetic">
+  <d:class name="Crate">
+    <d:cachevariable name="serialNumber" dataType="UaString" addressSpaceWrite="forbidden" initializeWith="configuration" nullPolicy="nullForbidden"/>
+    <d:cachevariable name="powerOn" dataType="OpcUa_Boolean" addressSpaceWrite="regular" initializeWith="valueAndStatus" nullPolicy="nullAllowed"/>
+    <d:sourcevariable name="temperature" dataType="OpcUa_Double" addressSpaceRead="asynchronous" addressSpaceWrite="forbidden"/>
+    <d:hasobjects class="Board" instantiateUsing="configuration"/>
+  </d:class>
+  <d:class name="Board">
+    <d:cachevariable name="address" dataType="OpcUa_UInt32" addressSpaceWrite="forbidden" initializeWith="configuration" nullPolicy="nullForbidden"/>
+    <d:cachevariable name="status" dataType="OpcUa_Int32" addressSpaceWrite="forbidden" initializeWith="valueAndStatus" nullPolicy="nullAllowed"/>
+    <d:cachevariable name="histogram" dataType="OpcUa_UInt32" addressSpaceWrite="forbidden" initializeWith="valueAndStatus" nullPolicy="nullAllowed"><d:array/></d:cachevariable>
+    <d:sourcevariable name="firmware" dataType="UaString" addressSpaceRead="synchronous" addressSpaceWrite="forbidden"/>
+    <d:hasobjects class="Channel" instantiateUsing="configuration"/>
+    <d:hasobjects class="Sensor" instantiateUsing="design"><d:object name="sensorA"/><d:object name="sensorB"/></d:hasobjects>
+  </d:class>
+  <d:class name="Channel">
+    <d:cachevariable name="value" dataType="OpcUa_Double" addressSpaceWrite="forbidden" initializeWith="valueAndStatus" nullPolicy="nullAllowed"/>
+    <d:cachevariable name="threshold" dataType="OpcUa_Double" addressSpaceWrite="regular" initializeWith="configuration" nullPolicy="nullForbidden"/>
+    <d:cachevariable name="enabled" dataType="OpcUa_Boolean" addressSpaceWrite="regular" initializeWith="valueAndStatus" nullPolicy="nullAllowed"/>
+  </d:class>
+  <d:class name="Sensor">
+    <d:cachevariable name="reading" dataType="OpcUa_Double" addressSpaceWrite="forbidden" initializeWith="valueAndStatus" nullPolicy="nullAllowed"/>
+  </d:class>
+  <d:class name="Monitor">
+    <d:cachevariable name="heartbeat" dataType="OpcUa_UInt64" addressSpaceWrite="forbidden" initializeWith="valueAndStatus" nullPolicy="nullAllowed"/>
+  </d:class>
+  <d:root>
+    <d:hasobjects class="Crate" instantiateUsing="configuration"/>
+    <d:hasobjects class="Monitor" instantiateUsing="design"><d:object name="monitor0"/></d:hasobjects>
+  </d:root>
+</d:design>
+'''
+
+def cv_profile_pool(profile_count):
+    """profile_count distinct sets of (cv_name, is_boolean), of 1 to 4 CVs each"""
+    pool = []
+    for index in range(profile_count):
+        size = 1 + index % 4
+        pool.append([(f'cv{index}_{position}', position == 0 and index % 3 == 0) for position in range(size)])
+    return pool
+
+def write_crate(output, crate_index, cv_profiles):
+    """One crate with its boards and channels; channels take the CV profiles of the pool round-robin"""
+    output.write(f'  <Crate name="crate{crate_index}" serialNumber="SN{crate_index:07d}">\n')
+    for board_index in range(BOARDS_PER_CRATE):
+        output.write(f'    <Board name="board{board_index}" address="{board_index}">\n')
+        for channel_index in range(CHANNELS_PER_BOARD):
+            output.write(f'      <Channel name="ch{channel_index}" threshold="{channel_index}.5">\n')
+            if cv_profiles:
+                profile = cv_profiles[(crate_index * BOARDS_PER_CRATE + board_index + channel_index) % len(cv_profiles)]
+                for cv_name, is_boolean in profile:
+                    output.write(f'        <CalculatedVariable name="{cv_name}" value="threshold*2" '
+                                 f'isBoolean="{"true" if is_boolean else "false"}"/>\n')
+            output.write('      </Channel>\n')
+        output.write('    </Board>\n')
+    output.write('  </Crate>\n')
+
+def generate_project(project_dir, instance_count, profile_count=16, entity_file_count=4):
+    """
+    Write Design/Design.xml and bin/config.xml (including bin/crates<N>.xml through external entities)
+    of a synthetic project with about instance_count configured instances, into project_dir.
+    Returns the path of the configuration file.
+    """
+    design_dir = os.path.join(project_dir, 'Design')
+    bin_dir = os.path.join(project_dir, 'bin')
+    os.makedirs(design_dir, exist_ok=True)
+    os.makedirs(bin_dir, exist_ok=True)
+
+    with open(os.path.join(design_dir, 'Design.xml'), mode='w', encoding='utf-8') as design:
+        design.write(DESIGN.format(namespace=DESIGN_NAMESPACE))
+
+    crate_count = max(1, math.ceil(instance_count / INSTANCES_PER_CRATE))
+    entity_file_count = max(1, min(entity_file_count, crate_count))
+    cv_profiles = cv_profile_pool(profile_count)
+
+    # Crates go round-robin to the entity files, the first file's share being declared in the main file itself
+    for entity_index in range(1, entity_file_count):
+        with open(os.path.join(bin_dir, f'crates{entity_index}.xml'), mode='w', encoding='utf-8') as entity:
+            for crate_index in range(entity_index, crate_count, entity_file_count):
+                write_crate(entity, crate_index, cv_profiles)
+
+    config_path = os.path.join(bin_dir, 'config.xml')
+    with open(config_path, mode='w', encoding='utf-8') as config:
+        config.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE configuration [\n')
+        for entity_index in range(1, entity_file_count):
+            config.write(f'<!ENTITY crates{entity_index} SYSTEM "crates{entity_index}.xml">\n')
+        config.write(f']>\n<configuration xmlns="{CONFIG_NAMESPACE}">\n')
+        for crate_index in range(0, crate_count, entity_file_count):
+            write_crate(config, crate_index, cv_profiles)
+        for entity_index in range(1, entity_file_count):
+            config.write(f'  &crates{entity_index};\n')
+        config.write('</configuration>\n')
+    return config_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic quasar project for benchmarking Cacophony")
+    parser.add_argument("project_dir", help="Directory to write Design/Design.xml and bin/config.xml into")
+    parser.add_argument("--instances", dest="instances", type=int, default=1000,
+                        help="Approximate number of configured instances")
+    parser.add_argument("--cv_profiles", dest="cv_profiles", type=int, default=16,
+                        help="Number of distinct calculated variable profiles (0: no calculated variables)")
+    parser.add_argument("--entity_files", dest="entity_files", type=int, default=4,
+                        help="Number of files the configuration is spread over, through external entities")
+    args = parser.parse_args()
+    config_path = generate_project(args.project_dir, args.instances, args.cv_profiles, args.entity_files)
+    print(f"Generated: {config_path}")
+
+if __name__ == "__main__":
+    main()
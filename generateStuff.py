@@ -4,103 +4,85 @@
 
 import sys
 import os
+import glob
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from colorama import Fore, Style
 
 thisModuleName = "Cacophony"
 
 sys.path.insert(0, 'FrameworkInternals')
 
-from transformDesign import transformDesign
-from DesignInspector import DesignInspector
 from ConfigInspector import ConfigInspector
+from GenerationPipeline import GenerationPipeline, LOG_LEVELS
+from BuildCache import BuildCache
+from DplWriter import DplWriter, parse_address_active
+from DesignValidator import DesignValidator
+from PhaseProfiler import PhaseProfiler
+from ServerManifest import Server, servers_from_config_files, servers_from_manifest
 from quasarExceptions import DesignFlaw
 import quasar_basic_utils
 from merge_design_and_meta import merge_user_and_meta_design
 
-# we use template_debug to print out to keep uniform debug style with what comes out as debug
-# from the transform itself
-from transform_filters import template_debug
-
-ObviousMapping = {  # these are unanimously good choices
-    'OpcUa_Boolean' : "DPEL_BOOL",
-    'OpcUa_UInt32'  : "DPEL_UINT",
-    'OpcUa_Int32'   : "DPEL_INT",
-    'OpcUa_UInt64'  : "DPEL_ULONG",
-    'OpcUa_Int64'   : "DPEL_LONG",
-    'OpcUa_Float'   : "DPEL_FLOAT",
-    'OpcUa_Double'  : "DPEL_FLOAT",
-    'UaString'      : "DPEL_STRING",
-    'UaByteString'  : "DPEL_BLOB"
-    }
-
-LessObviousMapping = {
-    'OpcUa_Byte'    : 'DPEL_UINT',
-    'OpcUa_SByte'   : 'DPEL_INT',
-    'OpcUa_UInt16'  : 'DPEL_UINT',
-    'OpcUa_Int16'   : 'DPEL_INT'
-}
-
-ObviousMappingArray = {  # these are unanimously good choices
-    'OpcUa_Boolean' : "DPEL_DYN_BOOL",
-    'OpcUa_UInt32'  : "DPEL_DYN_UINT",
-    'OpcUa_Int32'   : "DPEL_DYN_INT",
-    'OpcUa_UInt64'  : "DPEL_DYN_ULONG",
-    'OpcUa_Int64'   : "DPEL_DYN_LONG",
-    'OpcUa_Float'   : "DPEL_DYN_FLOAT",
-    'OpcUa_Double'  : "DPEL_DYN_FLOAT",
-    'UaString'      : "DPEL_DYN_STRING",
-    'UaByteString'  : "DPEL_DYN_BLOB"
-    }
-
-LessObviousMappingArray = {
-    'OpcUa_Byte'    : 'DPEL_DYN_UINT',
-    'OpcUa_SByte'   : 'DPEL_DYN_INT',
-    'OpcUa_UInt16'  : 'DPEL_DYN_UINT',
-    'OpcUa_Int16'   : 'DPEL_DYN_INT'
-}
-
-def handle_float_variables():
-    design_inspector = DesignInspector(os.path.sep.join(['Design', 'Design.xml']))
-    float_variables = []
-    for class_name in design_inspector.get_names_of_all_classes():
-        cvs = design_inspector.objectify_cache_variables(class_name,
-            "[@dataType='OpcUa_Float' and @addressSpaceWrite != 'forbidden' and not(d:array)]")
-        float_variables += ['{0}/{1}(cache-var)'.format(class_name, cv.get('name')) for cv in cvs]
-        svs = design_inspector.objectify_source_variables(class_name,
-            "[@dataType='OpcUa_Float' and @addressSpaceWrite != 'forbidden' and not(d:array)]")
-        float_variables += ['{0}/{1}(source-var)'.format(class_name, sv.get('name')) for sv in svs]
-    if len(float_variables) > 0:
-        raise Exception(("In your design, there is/are scalar variables of "
-                         "type OpcUa_Float. This data-type has no direct correspondence in "
-                         "WinCC OA and will cause problems especially when writing from WinCC "
-                         "OA. Please convert these variables to OpcUa_Double data-type. "
-                         "List of variables (incl class names): \n{0}").format(
-                         '\n'.join(float_variables)))
-
-def quasar_data_type_to_dpt_type_constant(quasar_data_type, cls, cv, noarray = True):
-    if(noarray) :
-        if quasar_data_type in ObviousMapping:
-            return ObviousMapping[quasar_data_type]
-        # for the remaining types, we have to do less obvious choices.
-        elif quasar_data_type in LessObviousMapping:
-            to = LessObviousMapping[quasar_data_type]
-            template_debug(("WARNING: mapped {0} to {1}, because of no corresponding type in WinCC OA. "
-                            "(at: class={2} cv={3})").format(quasar_data_type, to, cls, cv))
-            return to
-        else:
-            raise Exception("The following quasar datatype: '{0}' is not yet supported in Cacophony.".format(quasar_data_type))
-    else :
-        if quasar_data_type in ObviousMapping:
-            return ObviousMappingArray[quasar_data_type]
-        # for the remaining types, we have to do less obvious choices.
-        elif quasar_data_type in LessObviousMapping:
-            to = LessObviousMappingArray[quasar_data_type]
-            template_debug(("WARNING: mapped {0} to {1}, because of no corresponding type in WinCC OA. "
-                            "(at: class={2} cv={3})").format(quasar_data_type, to, cls, cv))
-            return to
-        else:
-            raise Exception("The following quasar datatype: '{0}' is not yet supported in Cacophony.".format(quasar_data_type))
+# (template, generated file) pairs rendered on every run
+OUTPUTS = [
+    ('designToDptCreation.jinja',             'createDpts.ctl'),
+    ('designToConfigParser.jinja',            'configParser.ctl'),
+    ('designToInstantiationFromDesign.jinja', 'instantiateFromDesign.ctl')
+    ]
+
+# (template, generated file) rendered with --previous_config_file
+DELTA_OUTPUT = ('designToConfigDelta.jinja', 'configDelta.ctl')
+
+# Templates imported by the ones of the outputs, inputs of every output
+SHARED_TEMPLATES = ['runtimeStats.jinja']
+
+# ASCII manager import file written with --dpl
+DPL_OUTPUT = 'configImport.dpl'
+
+def inspect_config(config_file_path, args, index_cache_dir, profiler):
+    """
+    ConfigInspector of a configuration file, with its index loaded from index_cache_dir when neither the file
+    nor its entity files changed since it was saved there (index_cache_dir None: always parsed)
+    """
+    options = dict(streaming=args.stream_config, use_xmllint=args.use_xmllint, profiler=profiler)
+    if index_cache_dir is None:
+        return ConfigInspector(config_file_path, **options)
+    config_inspector = ConfigInspector.cached(config_file_path, index_cache_dir, **options)
+    if config_inspector.loaded_from_cache:
+        print(Fore.GREEN + "  Configuration index loaded from the cache (unchanged since the previous run)" + Style.RESET_ALL)
+    return config_inspector
+
+def inspect_configs(config_file_paths, args, index_cache_dir, profiler):
+    """
+    ConfigInspectors of the configuration files, by path. With --jobs > 1 they are built concurrently in a pool
+    of processes, each file being parsed (or loaded from the cache) by one of them
+    """
+    if args.jobs <= 1 or len(config_file_paths) <= 1:
+        return {path: inspect_config(path, args, index_cache_dir, profiler) for path in config_file_paths}
+    config_inspectors = {}
+    with ProcessPoolExecutor(max_workers=min(args.jobs, len(config_file_paths))) as pool:
+        futures = {path: pool.submit(_inspect_in_worker, path, args, index_cache_dir, profiler.enabled)
+                   for path in config_file_paths}
+        for path, future in futures.items():
+            config_inspectors[path], phases = future.result()
+            profiler.extend(phases)
+    return config_inspectors
+
+def _inspect_in_worker(config_file_path, args, index_cache_dir, profile):
+    """Returns the ConfigInspector, which comes back without its tree (see ConfigInspector.__getstate__), and the phases recorded"""
+    profiler = PhaseProfiler(enabled=profile)
+    config_inspector = inspect_config(config_file_path, args, index_cache_dir, profiler)
+    return config_inspector, profiler.phases
+
+def report_profile(profiler, json_path):
+    """Print the phases recorded with --profile, and write them to json_path if given"""
+    if not profiler.enabled:
+        return
+    print(Fore.GREEN + "Profile of the run:\n" + Fore.BLUE + profiler.format_table() + Style.RESET_ALL)
+    if json_path:
+        profiler.write_json(json_path)
+        print(Fore.GREEN + f"Profile written to {json_path}" + Style.RESET_ALL)
 
 def main():
     parser = argparse.ArgumentParser()
@@ -110,58 +92,182 @@ def main():
     parser.add_argument("--subscription", dest="subscription", default="MyQuasarSubscription")
     parser.add_argument("--function_prefix", dest="function_prefix", default="")
     parser.add_argument("--use_design_with_meta", dest="use_design_with_meta", action="store_true",
-                        help="Merge Design.xml with Meta design and use DesignWithMeta.xml for generation")
+                        help="Merge Design.xml with Meta design and use the merged design for generation")
     parser.add_argument("--config_file", dest="config_file", default=None,
                         help="Configuration XML file to enable calculated variable support")
+    parser.add_argument("--config_files", dest="config_files", nargs='+', default=None, metavar="CONFIG_FILE",
+                        help="Generate for several servers at once, one per configuration file, into "
+                             "generated/<configuration file name>/ (the design is parsed once for all of them)")
+    parser.add_argument("--manifest", dest="manifest", default=None, metavar="PATH",
+                        help="Generate for the servers listed in the JSON manifest at PATH, each with its own "
+                             "configuration file and optionally server_name, driver_number, dpt_prefix... "
+                             "into generated/<name>/ (see ServerManifest.py)")
+    parser.add_argument("--previous_config_file", dest="previous_config_file", default=None,
+                        help="Previous version of the configuration file: additionally generates configDelta.ctl, "
+                             "applying only the changes between the two to a system configured from the previous one")
+    parser.add_argument("--stream_config", dest="stream_config", action="store_true",
+                        help="Index the configuration file in streaming mode, for very large configuration files")
+    parser.add_argument("--jobs", dest="jobs", type=int, default=1,
+                        help="Number of processes inspecting the configuration files and rendering and formatting the outputs concurrently")
+    parser.add_argument("--use_xmllint", dest="use_xmllint", action="store_true",
+                        help="Expand entities of the configuration file with 'xmllint --noent' instead of in-process")
+    parser.add_argument("--address_batch_size", dest="address_batch_size", type=int, default=0,
+                        help="Generate CTL committing the address configs of up to this many DPEs of an instance "
+                             "in one dpSetWait (default 0: one fwPeriphAddress_setOPCUA call per DPE)")
+    parser.add_argument("--log_level", dest="log_level", choices=LOG_LEVELS, default="DEBUG",
+                        help="Least severe log statements kept in the generated CTL, "
+                             "the ones below are left out of the generated code (default DEBUG: all of them)")
+    parser.add_argument("--runtime_stats", dest="runtime_stats", action="store_true",
+                        help="Generate CTL counting, per class, the instances, DPs, addresses, CV profiles and failures "
+                             "as well as the time spent, reported at the end of parseConfig, instantiateFromDesign "
+                             "and createDpts")
+    parser.add_argument("--worker_threads", dest="worker_threads", type=int, default=0, metavar="N",
+                        help="Generate parseConfig and instantiateFromDesign configuring the top-level instances "
+                             "with a pool of CTL threads taking them from a shared queue, N of them by default "
+                             "(default 0: one instance after the other, in the calling thread)")
+    parser.add_argument("--dpl", dest="dpl", action="store_true",
+                        help="Also write " + DPL_OUTPUT + ", a WinCC OA ASCII manager import file with the datapoints "
+                             "and address configs parseConfig would create for the configuration file. Its DP IDs "
+                             "are numbered from 1: import it into an empty system only, as they would collide with "
+                             "those of existing datapoints")
+    parser.add_argument("--address_active", dest="address_active", action="append", metavar="CLASS=REGEX",
+                        help="For --dpl: addresses of the variables of CLASS are active only if the variable name "
+                             "matches REGEX, like the addressActiveControl mapping of parseConfig (repeatable)")
+    parser.add_argument("--no_config_cache", dest="no_config_cache", action="store_true",
+                        help="Always parse the configuration file(s), instead of loading their index from the cache "
+                             "kept in generated/.cache when neither they nor their entity files changed")
+    parser.add_argument("--force", dest="force", action="store_true",
+                        help="Regenerate all outputs even if none of their inputs changed since the previous run")
+    parser.add_argument("--profile", dest="profile", action="store_true",
+                        help="Print the wall time, CPU time and peak memory of every phase of the run")
+    parser.add_argument("--profile_json", dest="profile_json", default=None, metavar="PATH",
+                        help="Write the --profile report as JSON to PATH (implies --profile)")
     args = parser.parse_args()
+    profiler = PhaseProfiler(enabled=args.profile or bool(args.profile_json))
 
     additional_params = {
         'typePrefix'       : args.dpt_prefix,
         'serverName'       : args.server_name,
         'driverNumber'     : args.driver_number,
         'subscriptionName' : args.subscription,
-        'functionPrefix'   : args.function_prefix}
-
-    # Handle optional calculated variable support
-    config_inspector = None
-    if args.config_file:
-        config_file_path = os.path.join(os.getcwd(), 'bin', args.config_file)
-        if not os.path.isfile(config_file_path):
-            raise FileNotFoundError(f"Configuration file not found: {config_file_path}")
-        print(Fore.CYAN + f"Enabling calculated variable support from: {config_file_path}" + Style.RESET_ALL)
-        config_inspector = ConfigInspector(config_file_path)
-        additional_params['configInspector'] = config_inspector
+        'functionPrefix'   : args.function_prefix,
+        'addressBatchSize' : args.address_batch_size,
+        'logLevel'         : args.log_level,
+        'runtimeStats'     : args.runtime_stats,
+        'workerThreads'    : args.worker_threads,
+        'previousConfigFile' : args.previous_config_file}
+
+    cacophony_root = os.path.dirname(os.path.sep.join([os.getcwd(), sys.argv[0]]))
+    print('Cacophony root is at: ' + cacophony_root)
+    templates_path = os.path.join(cacophony_root, 'templates')
+    generated_path = os.path.join(cacophony_root, 'generated')
+
+    user_design_path = os.path.join(os.getcwd(), 'Design', 'Design.xml')
+    meta_design_path = os.path.join(os.getcwd(), 'Meta', 'design', 'meta-design.xml')
+    config_dir = os.path.join(os.getcwd(), 'bin')
+    if args.config_files or args.manifest:
+        # Multi-server mode: one output directory under generated/ per server
+        if args.config_file or args.previous_config_file:
+            raise Exception("ERROR: --config_files and --manifest list the configuration files themselves, "
+                            "they can't be combined with --config_file or --previous_config_file")
+        if args.config_files and args.manifest:
+            raise Exception("ERROR: use either --config_files or --manifest, not both")
+        if args.manifest:
+            servers = servers_from_manifest(args.manifest, config_dir, generated_path)
+        else:
+            servers = servers_from_config_files(args.config_files, config_dir, generated_path)
+        print(Fore.CYAN + f"Generating for {len(servers)} servers: {', '.join(server.name for server in servers)}"
+              + Style.RESET_ALL)
+    else:
+        config_file_path = os.path.join(config_dir, args.config_file) if args.config_file else None
+        previous_config_file_path = os.path.join(config_dir, args.previous_config_file) if args.previous_config_file else None
+        if previous_config_file_path and not config_file_path:
+            raise Exception("ERROR: --previous_config_file needs --config_file, the configuration it is compared with")
+        servers = [Server(None, generated_path, config_file_path, previous_config_file_path)]
+    if args.dpl and not all(server.config_file_path for server in servers):
+        raise Exception("ERROR: --dpl needs --config_file, the configuration to write the import file of")
+    address_active = parse_address_active(args.address_active)
+
+    # Incremental generation: outputs whose inputs didn't change since the previous run are skipped
+    build_cache = BuildCache(generated_path)
+    with profiler.phase('build cache check', servers=len(servers)):
+        for server in servers:
+            server.build_parameters = dict(additional_params, **server.parameters,
+                                           useDesignWithMeta=args.use_design_with_meta,
+                                           configFile=server.config_file_path,
+                                           addressActive=args.address_active)
+            server.outputs = [(template_name, os.path.join(server.output_dir, output_name))
+                              for template_name, output_name in OUTPUTS]
+            if server.previous_config_file_path:
+                server.outputs.append((DELTA_OUTPUT[0], os.path.join(server.output_dir, DELTA_OUTPUT[1])))
+            server.dpl_path = os.path.join(server.output_dir, DPL_OUTPUT) if args.dpl else None
+            if not args.force:
+                server.outputs = [(template_name, output_path) for template_name, output_path in server.outputs
+                                  if not build_cache.is_up_to_date(output_path, server.build_parameters)]
+                if server.dpl_path and build_cache.is_up_to_date(server.dpl_path, server.build_parameters):
+                    server.dpl_path = None
+    servers_to_generate = [server for server in servers if server.outputs or server.dpl_path]
+    if not servers_to_generate:
+        print(Fore.GREEN + "All generated files are up to date, nothing to do (use --force to regenerate anyway)"
+              + Style.RESET_ALL)
+        report_profile(profiler, args.profile_json)
+        return
+    for server in servers:
+        if server not in servers_to_generate:
+            print(Fore.GREEN + f"Generated files of {server.label()} are up to date" + Style.RESET_ALL)
+
+    # Handle optional calculated variable support; the configuration files of all the servers are inspected
+    # up front, concurrently with --jobs
+    index_cache_dir = None if args.no_config_cache else build_cache.derived_dir
+    config_file_paths = []
+    for server in servers_to_generate:
+        if server.config_file_path:
+            if not os.path.isfile(server.config_file_path):
+                raise FileNotFoundError(f"Configuration file not found: {server.config_file_path}")
+            print(Fore.CYAN + f"Enabling calculated variable support from: {server.config_file_path}" + Style.RESET_ALL)
+            config_file_paths.append(server.config_file_path)
+        if server.previous_config_file_path:
+            if not os.path.isfile(server.previous_config_file_path):
+                raise FileNotFoundError(f"Previous configuration file not found: {server.previous_config_file_path}")
+            print(Fore.CYAN + f"Comparing with the previous configuration: {server.previous_config_file_path}"
+                  + Style.RESET_ALL)
+            config_file_paths.append(server.previous_config_file_path)
+    config_file_paths = list(dict.fromkeys(config_file_paths))
+    if config_file_paths:
+        with profiler.phase('config inspection', files=len(config_file_paths), jobs=args.jobs):
+            config_inspectors = inspect_configs(config_file_paths, args, index_cache_dir, profiler)
+
+    for server in servers_to_generate:
+        if not server.config_file_path:
+            continue
+        server.config_inspector = config_inspectors[server.config_file_path]
+        prefix = f"  [{server.name}]" if server.name else ""
 
         # Print summary - get all unique CV names across all classes
         all_cv_names = set()
-        for class_cvs in config_inspector.calc_vars_by_class.values():
+        for class_cvs in server.config_inspector.calc_vars_by_class.values():
             all_cv_names.update(class_cvs.keys())
 
-        print(Fore.GREEN + f"  Found {len(all_cv_names)} unique calculated variable(s):" + Style.RESET_ALL)
-        for class_name, class_cvs in config_inspector.calc_vars_by_class.items():
+        print(Fore.GREEN + f"{prefix}  Found {len(all_cv_names)} unique calculated variable(s):" + Style.RESET_ALL)
+        for class_name, class_cvs in server.config_inspector.calc_vars_by_class.items():
             cv_names = sorted(class_cvs.keys())
-            print(Fore.BLUE + f"    {class_name}: {len(cv_names)} variable(s) - {', '.join(cv_names)}" + Style.RESET_ALL)
-    else:
-        additional_params['configInspector'] = None
+            print(Fore.BLUE + f"{prefix}    {class_name}: {len(cv_names)} variable(s) - {', '.join(cv_names)}"
+                  + Style.RESET_ALL)
+
+        if server.previous_config_file_path:
+            server.previous_config_inspector = config_inspectors[server.previous_config_file_path]
 
     print(Fore.GREEN + "For your information, current settings are: \n" + Fore.BLUE
-        + '\n'.join([('  {0:20} : {1}'.format(k, additional_params[k])) for k in additional_params.keys() if k != 'configInspector'])
+        + '\n'.join([('  {0:20} : {1}'.format(k, additional_params[k])) for k in additional_params.keys()])
         + Style.RESET_ALL)
-
-    additional_params.update({'mapper' : quasar_data_type_to_dpt_type_constant})
-
-    cacophony_root = os.path.dirname(os.path.sep.join([os.getcwd(), sys.argv[0]]))
-    print('Cacophony root is at: ' + cacophony_root)
+    for server in servers_to_generate:
+        if server.parameters:
+            print(Fore.BLUE + f"  [{server.name}] " + ', '.join(f'{k} : {v}' for k, v in server.parameters.items())
+                  + Style.RESET_ALL)
 
     # Determine which design file to use
     if args.use_design_with_meta:
         print(Fore.YELLOW + "Using DesignWithMeta (merging Design.xml with meta-design.xml)..." + Style.RESET_ALL)
-        design_xml_filename = 'DesignWithMeta.xml'
-        design_xml_path: str = os.path.join(os.getcwd(), 'Design', design_xml_filename)
-
-        # Create the merged design file
-        user_design_path = os.path.join(os.getcwd(), 'Design', 'Design.xml')
-        meta_design_path = os.path.join(os.getcwd(), 'Meta', 'design', 'meta-design.xml')
 
         # Check that required files exist
         if not os.path.isfile(user_design_path):
@@ -169,50 +275,104 @@ def main():
         if not os.path.isfile(meta_design_path):
             raise FileNotFoundError(f"Meta design file not found: {meta_design_path}")
 
-        print(f"  Merging: {user_design_path}")
-        print(f"      with: {meta_design_path}")
-        print(f"      into: {design_xml_path}")
+        def merge(merged_file):
+            print(f"  Merging: {user_design_path}")
+            print(f"      with: {meta_design_path}")
+            with open(user_design_path, mode='r', encoding='utf-8') as user_file, \
+                 open(meta_design_path, mode='r', encoding='utf-8') as meta_file:
+                merge_user_and_meta_design(user_file, meta_file, merged_file)
 
-        with open(user_design_path, mode='r', encoding='utf-8') as user_file, \
-             open(meta_design_path, mode='r', encoding='utf-8') as meta_file, \
-             open(design_xml_path, mode='w', encoding='utf-8') as merged_file:
-            merge_user_and_meta_design(user_file, meta_file, merged_file)
-
-        print(Fore.GREEN + "  DesignWithMeta.xml created successfully!" + Style.RESET_ALL)
+        # The merge runs in memory and is kept in the build cache by the content of both designs:
+        # nothing is written to Design/, and unchanged designs aren't merged again
+        with profiler.phase('meta-design merge'):
+            design_xml_path: str = build_cache.derived_file('DesignWithMeta.xml', [user_design_path, meta_design_path], merge)
+        print(Fore.GREEN + f"  Merged design: {design_xml_path}" + Style.RESET_ALL)
     else:
         print(Fore.YELLOW + "Using Design.xml (default behavior)" + Style.RESET_ALL)
-        design_xml_path: str = os.path.join(os.getcwd(), 'Design', 'Design.xml')
+        design_xml_path: str = user_design_path
 
     try:
-        handle_float_variables()
-        transformDesign(
-            os.path.join(cacophony_root, 'templates', 'designToDptCreation.jinja'),
-            designXmlPath=design_xml_path,
-            outputFile=os.path.join(cacophony_root, 'generated', 'createDpts.ctl'),
-            requiresMerge=False,
-            astyleRun=True,
-            additionalParam=additional_params)
-
-        transformDesign(
-            os.path.join(cacophony_root, 'templates', 'designToConfigParser.jinja'),
-            designXmlPath=design_xml_path,
-            outputFile=os.path.join(cacophony_root, 'generated', 'configParser.ctl'),
-            requiresMerge=False,
-            astyleRun=True,
-            additionalParam=additional_params)
-
-        transformDesign(
-            os.path.join(cacophony_root, 'templates', 'designToInstantiationFromDesign.jinja'),
-            designXmlPath=design_xml_path,
-            outputFile=os.path.join(cacophony_root, 'generated', 'instantiateFromDesign.ctl'),
-            requiresMerge=False,
-            astyleRun=True,
-            additionalParam=additional_params)
-
-        # Clean up: delete DesignWithMeta.xml if it was created
-        if args.use_design_with_meta and os.path.isfile(design_xml_path):
-            os.remove(design_xml_path)
-            print(Fore.YELLOW + f"  Cleaned up: {design_xml_path} deleted" + Style.RESET_ALL)
+        # The design is parsed once, validated once, and shared by all the renders of all the servers
+        with profiler.phase('design loading') as counts:
+            pipeline = GenerationPipeline(design_xml_path, templates_path, additional_params)
+            counts['classes'] = len(pipeline.design_inspector.get_names_of_all_classes())
+        # All the problems of the design are reported at once, before rendering anything
+        with profiler.phase('design validation') as counts:
+            validator = DesignValidator(pipeline.design_inspector)
+            counts.update(classes=len(validator.class_names), variables=validator.variable_count,
+                          errors=len(validator.errors), warnings=len(validator.warnings))
+        if validator.warnings:
+            print(Fore.YELLOW + "Design validation warnings:\n" + validator.report() + Style.RESET_ALL)
+        validator.raise_on_errors()
+        additional_params['dpelTypes'] = validator.dpel_types
+
+        # Differential reconfiguration between the previous and the current configuration, over the instances
+        # parseConfig configures according to the design
+        for server in servers_to_generate:
+            if not server.previous_config_inspector:
+                continue
+            prefix = f"  [{server.name}]" if server.name else ""
+            phase_suffix = f" {server.name}" if server.name else ""
+            with profiler.phase('config diff' + phase_suffix) as counts:
+                server.config_diff = ConfigInspector.diff(server.previous_config_inspector, server.config_inspector,
+                                                          pipeline.design_inspector.get_configured_classes)
+                counts.update((kind, len(server.config_diff[kind])) for kind in ('added', 'removed', 'modified'))
+            print(Fore.GREEN + "{0}  {1} added, {2} removed, {3} modified instance(s), {4} with a CV profile change".format(
+                prefix, len(server.config_diff['added']), len(server.config_diff['removed']),
+                len(server.config_diff['modified']),
+                sum(1 for instance in server.config_diff['modified'] if instance['cv_profile_changed']))
+                + Style.RESET_ALL)
+            if server.config_diff['ignored']:
+                print(Fore.YELLOW + "{0}  {1} named element(s) not configured by parseConfig left out of the delta: {2}".format(
+                    prefix, len(server.config_diff['ignored']), ', '.join(server.config_diff['ignored'][:5])
+                    + (', ...' if len(server.config_diff['ignored']) > 5 else '')) + Style.RESET_ALL)
+
+        # The outputs of all the servers are rendered together, so that --jobs spreads them over the processes
+        outputs = []
+        for server in servers_to_generate:
+            server_params = dict(server.parameters,
+                                 configInspector=server.config_inspector,
+                                 configDiff=server.config_diff)
+            outputs += [(template_name, output_path, server_params) for template_name, output_path in server.outputs]
+        with profiler.phase('rendering', outputs=len(outputs), jobs=args.jobs):
+            pipeline.render_all(outputs, jobs=args.jobs, profiler=profiler)
+        for server in servers_to_generate:
+            if not server.dpl_path:
+                continue
+            settings = dict(additional_params, **server.parameters)
+            with profiler.phase('dpl writing' + (f' {server.name}' if server.name else '')) as counts:
+                dpl_writer = DplWriter(pipeline.design_inspector, server.config_inspector,
+                                       settings['typePrefix'], settings['serverName'], settings['driverNumber'],
+                                       settings['subscriptionName'], address_active)
+                os.makedirs(server.output_dir, exist_ok=True)
+                dp_count = dpl_writer.write(server.dpl_path)
+                counts['datapoints'] = dp_count
+            print(Fore.GREEN + f"Generated: {server.dpl_path} ({dp_count} datapoints)" + Style.RESET_ALL)
+            print(Fore.YELLOW + "  Its DP IDs are numbered from 1: import it into an empty system only" + Style.RESET_ALL)
+
+        # Every input any output depends on; Cacophony sources are included as they shape the outputs too
+        common_input_paths = ([user_design_path] + sorted(glob.glob(os.path.join(cacophony_root, '*.py')))
+                              + [os.path.join(templates_path, template_name) for template_name in SHARED_TEMPLATES])
+        if args.use_design_with_meta:
+            common_input_paths.append(meta_design_path)
+        with profiler.phase('build cache update', servers=len(servers_to_generate)):
+            for server in servers_to_generate:
+                input_paths = list(common_input_paths)
+                if server.config_inspector:
+                    input_paths += [server.config_file_path] + server.config_inspector.entity_files
+                if server.previous_config_inspector:
+                    input_paths += [server.previous_config_file_path] + server.previous_config_inspector.entity_files
+                for template_name, output_path in server.outputs:
+                    build_cache.record(output_path, [os.path.join(templates_path, template_name)] + input_paths,
+                                       server.build_parameters)
+                if server.dpl_path:
+                    build_cache.record(server.dpl_path, input_paths, server.build_parameters)
+            build_cache.save()
+        if args.jobs <= 1:
+            print(Fore.GREEN + "Design query cache statistics:\n" + Fore.BLUE
+                  + pipeline.design_inspector.format_statistics() + Style.RESET_ALL)
+
+        report_profile(profiler, args.profile_json)
 
     except:
         quasar_basic_utils.quasaric_exception_handler()